@@ -0,0 +1,266 @@
+"""
+打分与显示热路径的微基准：
+
+    python -m benchmarks.bench_scoring --out bench_results.json
+    python -m benchmarks.bench_scoring --out new.json --compare old.json
+
+对仓库自带图片（i0.png, i1.jpg, i2.jpg, image.png）和逐渐增大的合成图片分别计时，
+输出吞吐、延迟分位数和峰值内存（Python 分配与常驻内存增长，JSON），便于在不同提交之间对比。
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Callable, List
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASSETS = ["i0.png", "i1.jpg", "i2.jpg", "image.png"]
+SYNTHETIC_SIDES = [256, 512, 1024, 2048]
+PROMPT = "a watercolor painting of a cat sitting on a windowsill at sunset"
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def _rss_bytes() -> int:
+    """当前进程的常驻内存（Linux 读 /proc，其他平台返回 0）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def measure_memory(fn: Callable[[], object], setup: Callable[[], None] = None, interval: float = 0.001) -> dict:
+    """
+    单独运行一次 fn 测量内存，不与计时混在一起（tracemalloc 会显著拖慢 Python 分配）
+
+    返回:
+        peak_mem_mb: tracemalloc 统计的 Python 分配峰值
+        peak_rss_mb: 运行期间常驻内存相对开始时的最大增长，包含 torch / numpy 等原生分配
+    """
+    if setup:
+        setup()
+    baseline = _rss_bytes()
+    peak_rss = baseline
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak_rss
+        while not done.is_set():
+            peak_rss = max(peak_rss, _rss_bytes())
+            done.wait(interval)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        done.set()
+        sampler.join()
+    peak_rss = max(peak_rss, _rss_bytes())
+    return {"peak_mem_mb": peak / 2 ** 20, "peak_rss_mb": (peak_rss - baseline) / 2 ** 20}
+
+
+def bench(name: str, fn: Callable[[], object], iterations: int, warmup: int = 1, setup: Callable[[], None] = None) -> dict:
+    """
+    运行 fn 若干次，返回延迟分位数（毫秒）、吞吐（次/秒）和峰值内存（MB，见 measure_memory）
+
+    计时和内存测量分两遍进行，计时时不开启 tracemalloc。
+
+    参数:
+        setup: 每次计时前调用（不计入耗时），例如清空缓存以测量冷启动路径
+    """
+    for _ in range(warmup):
+        if setup:
+            setup()
+        fn()
+    latencies = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    total = sum(latencies)
+    return {
+        "name": name,
+        "iterations": iterations,
+        "mean_ms": total / iterations * 1000,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "throughput_per_s": iterations / total if total else 0.0,
+        **measure_memory(fn, setup),
+    }
+
+
+def synthetic_image(side: int, seed: int) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (side, side, 3), dtype=np.uint8))
+
+
+def load_inputs() -> dict:
+    images = {}
+    for name in ASSETS:
+        path = os.path.join(ROOT, name)
+        if os.path.exists(path):
+            img = Image.open(path)
+            img.load()
+            images[name] = img
+    for side in SYNTHETIC_SIDES:
+        images[f"synthetic_{side}"] = synthetic_image(side, side)
+    return images
+
+
+class Fresh:
+    """每次 reset() 复制出一个新的图片对象，用于测量不命中任何缓存的冷路径"""
+
+    def __init__(self, img: Image.Image, clear: Callable[[], None] = None):
+        self.source = img
+        self.clear = clear
+        self.image = img
+
+    def reset(self):
+        self.image = self.source.copy()
+        if self.clear:
+            self.clear()
+
+
+def run_pixel_benchmarks(images: dict, iterations: int) -> List[dict]:
+    from src.call_llm import get_loss
+    results = []
+    reference = synthetic_image(512, 0)
+    for name, img in images.items():
+        results.append(bench(f"get_loss[{name}]", lambda: get_loss(img, reference), iterations))
+    return results
+
+
+def run_display_benchmarks(images: dict, iterations: int) -> List[dict]:
+    from src import image_io
+    results = []
+    for name, img in images.items():
+        # 冷路径：每次使用新的图片对象，派生缓存不会命中
+        fresh = Fresh(img)
+        results.append(bench(
+            f"display_thumbnail_cold[{name}]", lambda: image_io.display_thumbnail(fresh.image), iterations, setup=fresh.reset,
+        ))
+        results.append(bench(f"display_thumbnail_warm[{name}]", lambda: image_io.display_thumbnail(img), iterations))
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+        root.withdraw()
+    except Exception:
+        return results
+    try:
+        from image import ImagePromptGame
+        app = ImagePromptGame(root)
+        for name, img in images.items():
+            results.append(bench(
+                f"ImagePromptGame.display_image[{name}]",
+                lambda: app.display_image(img, app.generated_canvas),
+                iterations,
+            ))
+        app.pipeline.shutdown()
+    finally:
+        root.destroy()
+    return results
+
+
+def run_clip_benchmarks(images: dict, iterations: int) -> List[dict]:
+    from src import loss
+    loss.warm_up(background=False)
+    results = []
+    clear = loss.embedding_cache.clear
+    results.append(bench("get_string_embedding_cold", lambda: loss.get_string_embedding(PROMPT), iterations, setup=clear))
+    results.append(bench("get_string_embedding_warm", lambda: loss.get_string_embedding(PROMPT), iterations))
+    for name, img in images.items():
+        fresh = Fresh(img, clear)
+        results.append(bench(
+            f"get_clip_embedding_cold[{name}]", lambda: loss.get_clip_embedding(fresh.image), iterations, setup=fresh.reset,
+        ))
+        results.append(bench(f"get_clip_embedding_warm[{name}]", lambda: loss.get_clip_embedding(img), iterations))
+    target = Fresh(images.get("i1.jpg") or next(iter(images.values())), clear)
+    candidate = Fresh(images.get("i2.jpg") or target.source)
+
+    def reset_both():
+        target.reset()
+        candidate.reset()
+    results.append(bench(
+        "calculate_loss_with_image_cold",
+        lambda: loss.calculate_loss_with_image(target.image, candidate.image), iterations, setup=reset_both,
+    ))
+    results.append(bench(
+        "calculate_loss_with_string_cold",
+        lambda: loss.calculate_loss_with_string(PROMPT, target.image), iterations, setup=target.reset,
+    ))
+    results.append(bench(
+        "calculate_loss_with_string_warm", lambda: loss.calculate_loss_with_string(PROMPT, target.source), iterations,
+    ))
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(new: dict, old_path: str):
+    """打印与旧结果的 p50 对比（>1 表示变慢）"""
+    with open(old_path, encoding="utf-8") as f:
+        old = {r["name"]: r for r in json.load(f)["results"]}
+    print(f"{'benchmark':<55} {'old p50':>10} {'new p50':>10} {'ratio':>7}")
+    for r in new["results"]:
+        if r["name"] in old and old[r["name"]]["p50_ms"]:
+            ratio = r["p50_ms"] / old[r["name"]]["p50_ms"]
+            print(f"{r['name']:<55} {old[r['name']]['p50_ms']:>10.2f} {r['p50_ms']:>10.2f} {ratio:>7.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="打分与显示热路径的微基准")
+    parser.add_argument("--out", default="bench_results.json", help="结果 JSON 输出路径")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--skip-clip", action="store_true", help="跳过 CLIP 相关基准（不加载模型）")
+    parser.add_argument("--skip-display", action="store_true", help="跳过显示相关基准")
+    parser.add_argument("--compare", help="与之前的结果 JSON 对比")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    images = load_inputs()
+    results = run_pixel_benchmarks(images, args.iterations)
+    if not args.skip_display:
+        results += run_display_benchmarks(images, args.iterations)
+    if not args.skip_clip:
+        results += run_clip_benchmarks(images, args.iterations)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    for r in results:
+        print(f"{r['name']:<55} p50 {r['p50_ms']:9.2f} ms  p95 {r['p95_ms']:9.2f} ms  {r['throughput_per_s']:9.1f}/s  peak {r['peak_mem_mb']:7.1f} MB  rss +{r['peak_rss_mb']:7.1f} MB")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
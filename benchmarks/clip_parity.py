@@ -0,0 +1,153 @@
+"""
+CLIP 推理后端的精度与速度对照：
+
+    python -m benchmarks.clip_parity
+    python -m benchmarks.clip_parity --backends eager int8 onnx --threads 4 --tolerance 0.005 --out parity.json
+
+以 eager fp32 为参考，对仓库自带图片和提示词计算每个后端嵌入的余弦偏差（1 - cos）、
+图文相似度矩阵的最大偏差和前向耗时，并给出偏差在容忍范围内的最快后端。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from benchmarks.bench_scoring import ASSETS, PROMPT, ROOT
+
+IMAGES = ASSETS + ["best_image_1.png", "black.png"]
+PROMPTS = [
+    PROMPT,
+    "一只猫坐在窗台上",
+    "a black square",
+    "a photo of a city street at night with neon lights and rain reflections",
+]
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12)
+
+
+def _time(fn: Callable[[], np.ndarray], repeat: int):
+    """返回 (最后一次结果, 中位耗时毫秒)"""
+    fn()  # 预热
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        latencies.append(time.perf_counter() - start)
+    return out, float(np.median(latencies)) * 1000
+
+
+def load_inputs(processor):
+    from src import image_io
+    images = [image_io.load_image(os.path.join(ROOT, name)) for name in IMAGES if os.path.exists(os.path.join(ROOT, name))]
+    prompts = list(PROMPTS)
+    prompt_path = os.path.join(ROOT, "best_prompt_1.txt")
+    if os.path.exists(prompt_path):
+        with open(prompt_path, encoding="utf-8") as f:
+            prompts.append(f.read().strip())
+    pixel_values = processor(images=[img.convert("RGB") for img in images], return_tensors="pt")["pixel_values"]
+    return len(images), pixel_values, prompts
+
+
+def run_parity(backends: List[str], threads: int = None, repeat: int = 5, tolerance: float = 0.005) -> dict:
+    from transformers import CLIPModel, CLIPProcessor
+    from src import clip_backend
+    from src.loss import MODEL_NAME
+
+    clip_backend.set_num_threads(threads)
+    processor = CLIPProcessor.from_pretrained(MODEL_NAME)
+    model = CLIPModel.from_pretrained(MODEL_NAME).eval()
+    n_images, pixel_values, prompts = load_inputs(processor)
+
+    def text_inputs(padding):
+        return processor(text=prompts, return_tensors="pt", truncation=True, padding=padding,
+                         max_length=clip_backend.TEXT_LENGTH)
+
+    reference = clip_backend.EagerBackend(model, threads)
+    ref_inputs = text_inputs(reference.text_padding)
+    ref_image = _normalize(reference.image_features(pixel_values))
+    ref_text = _normalize(reference.text_features(ref_inputs["input_ids"], ref_inputs["attention_mask"]))
+    ref_scores = ref_text @ ref_image.T
+
+    results: Dict[str, dict] = {}
+    for name in backends:
+        start = time.perf_counter()
+        try:
+            backend = clip_backend.create_backend(name, model, threads, MODEL_NAME)
+        except Exception as e:  # 可选依赖缺失或导出失败时跳过该后端
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+            continue
+        init_s = time.perf_counter() - start
+        inputs = text_inputs(backend.text_padding)
+        image, image_ms = _time(lambda: backend.image_features(pixel_values), repeat)
+        text, text_ms = _time(lambda: backend.text_features(inputs["input_ids"], inputs["attention_mask"]), repeat)
+        image, text = _normalize(image), _normalize(text)
+        image_cos = np.sum(image * ref_image, axis=1)
+        text_cos = np.sum(text * ref_text, axis=1)
+        drift = float(max(1 - image_cos.min(), 1 - text_cos.min()))
+        results[name] = {
+            "init_s": init_s,
+            "image_batch_ms": image_ms,
+            "image_ms_per_item": image_ms / n_images,
+            "text_batch_ms": text_ms,
+            "text_ms_per_item": text_ms / len(prompts),
+            "image_cos_min": float(image_cos.min()),
+            "image_cos_mean": float(image_cos.mean()),
+            "text_cos_min": float(text_cos.min()),
+            "text_cos_mean": float(text_cos.mean()),
+            "max_drift": drift,
+            # 游戏中实际使用的是图文 / 图图相似度，这里直接给出分数的最大变化
+            "score_max_abs_diff": float(np.abs(text @ image.T - ref_scores).max()),
+            "within_tolerance": drift <= tolerance,
+        }
+
+    ok = {name: r for name, r in results.items() if r.get("within_tolerance")}
+    fastest = min(ok, key=lambda name: ok[name]["image_ms_per_item"] + ok[name]["text_ms_per_item"]) if ok else None
+    return {
+        "model": MODEL_NAME,
+        "threads": threads,
+        "images": n_images,
+        "prompts": len(prompts),
+        "tolerance": tolerance,
+        "backends": results,
+        "recommended": fastest,
+    }
+
+
+def main(argv=None):
+    from src.clip_backend import BACKENDS
+
+    parser = argparse.ArgumentParser(description="CLIP 推理后端的精度与速度对照")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--threads", type=int, help="推理线程数，默认使用 torch 的默认值")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.005, help="允许的最大余弦偏差 1 - cos")
+    parser.add_argument("--out", help="结果 JSON 输出路径")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    report = run_parity(args.backends, args.threads, args.repeat, args.tolerance)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    for name, r in report["backends"].items():
+        if "error" in r:
+            print(f"{name:<12} 不可用：{r['error']}", file=sys.stderr)
+        else:
+            print(
+                f"{name:<12} 图片 {r['image_ms_per_item']:7.1f}ms/张  文本 {r['text_ms_per_item']:6.1f}ms/条  "
+                f"偏差 {r['max_drift']:.2e}  {'✓' if r['within_tolerance'] else '✗'}",
+                file=sys.stderr,
+            )
+    print(f"推荐后端：{report['recommended']}（设置 CLIP_BACKEND={report['recommended']}）", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
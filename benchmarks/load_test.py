@@ -0,0 +1,115 @@
+"""
+端到端压测：以给定并发驱动 src/call_llm 的真实代码路径，默认打到进程内启动的桩服务。
+
+    python -m benchmarks.load_test --mode chat --requests 500 --concurrency 32
+    python -m benchmarks.load_test --mode image --requests 100 --concurrency 8 --error-rate 0.05
+    python -m benchmarks.load_test --mode chat --url http://127.0.0.1:8765   # 使用外部启动的桩服务
+
+输出 p50 / p95 / p99 延迟、吞吐、错误数和连接复用统计（JSON）。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.stub_server import add_config_args, config_from_args, start_stub_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def point_clients_at(url: str):
+    """让 src/clients 的客户端使用桩服务（需在首次创建客户端前调用）"""
+    os.environ["SILICON_BASE_URL"] = f"{url}/v1"
+    os.environ["ZHIPUAI_BASE_URL"] = f"{url}/api/paas/v4"
+    os.environ.setdefault("SILICON_API_KEY", "stub")
+    os.environ.setdefault("ZHIPUAI_API_KEY", "stub.secret")
+
+
+def run_load(mode: str, total: int, concurrency: int, stream: bool = False, max_tokens: int = 2000) -> dict:
+    from src import call_llm
+
+    def one(i: int):
+        start = time.perf_counter()
+        ok = True
+        try:
+            if mode == "chat" or (mode == "mixed" and i % 2 == 0):
+                # 每个请求内容不同且关闭缓存，保证每次都真正发出请求
+                prompt = f"load-test {uuid.uuid4().hex}"
+                if stream:
+                    # 出错时生成器的返回值（StopIteration.value）为 None
+                    chunks = call_llm.get_chat_completion("system", prompt, max_tokens, use_cache=False, use_stream=True)
+                    while True:
+                        try:
+                            next(chunks)
+                        except StopIteration as stop:
+                            ok = stop.value is not None
+                            break
+                else:
+                    ok = call_llm.get_chat_completion("system", prompt, max_tokens, use_cache=False) is not None
+            else:
+                call_llm.get_image_generate(f"load-test {i}")
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+    latencies = np.array([t for t, ok in outcomes if ok]) * 1000
+    errors = sum(1 for _, ok in outcomes if not ok)
+    return {
+        "mode": mode,
+        "stream": stream,
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "throughput_per_s": total / elapsed if elapsed else 0.0,
+        "p50_ms": float(np.percentile(latencies, 50)) if latencies.size else None,
+        "p95_ms": float(np.percentile(latencies, 95)) if latencies.size else None,
+        "p99_ms": float(np.percentile(latencies, 99)) if latencies.size else None,
+        "pool": call_llm.get_pool_stats(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="src/call_llm 端到端压测")
+    parser.add_argument("--mode", choices=["chat", "image", "mixed"], default="chat")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--stream", action="store_true", help="chat 请求使用流式输出")
+    parser.add_argument("--max-tokens", type=int, default=2000)
+    parser.add_argument("--url", help="外部桩服务地址，不填则在进程内启动")
+    parser.add_argument("--out", help="结果 JSON 输出路径")
+    add_config_args(parser)
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    server = None
+    url = args.url
+    if url is None:
+        server = start_stub_server(config_from_args(args))
+        url = server.url
+    point_clients_at(url)
+    try:
+        report = run_load(args.mode, args.requests, args.concurrency, args.stream, args.max_tokens)
+    finally:
+        if server is not None:
+            server.shutdown()
+    if server is not None:
+        report["server_requests"] = dict(server.requests)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
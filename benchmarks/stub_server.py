@@ -0,0 +1,219 @@
+"""
+本地 OpenAI / ZhipuAI 兼容的桩服务，用于离线压测：
+
+    python -m benchmarks.stub_server --port 8765 --latency-ms 300 --error-rate 0.05
+
+然后设置
+    SILICON_BASE_URL=http://127.0.0.1:8765/v1
+    ZHIPUAI_BASE_URL=http://127.0.0.1:8765/api/paas/v4
+即可让 src/call_llm 的真实代码路径打到本服务。
+"""
+import argparse
+import io
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+
+@dataclass
+class StubConfig:
+    latency_ms: float = 200.0      # 延迟中位数
+    latency_sigma: float = 0.5     # 对数正态分布的 sigma，0 表示固定延迟
+    error_rate: float = 0.0        # 返回 429 / 500 的概率
+    completion_tokens: int = 64    # 每次补全返回的 token 数
+    prompt_tokens: int = 32
+    stream_chunk_ms: float = 5.0   # 流式输出时块与块之间的间隔
+    image_size: int = 512
+    seed: int = 0
+
+    def sample_latency(self, rng: random.Random) -> float:
+        if self.latency_sigma <= 0:
+            return self.latency_ms / 1000
+        return rng.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持长连接，便于观察连接复用
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self) -> StubConfig:
+        return self.server.config
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _maybe_fail(self) -> bool:
+        """按配置的延迟等待，并以 error_rate 的概率返回错误"""
+        rng = self.server.rng()
+        time.sleep(self.config.sample_latency(rng))
+        if rng.random() < self.config.error_rate:
+            status = rng.choice([429, 500, 503])
+            self._send_json(status, {"error": {"message": "stub error", "code": str(status)}})
+            return True
+        return False
+
+    def do_POST(self):
+        self.server.count(self.path)
+        if self.path.endswith("/chat/completions"):
+            self._chat(self._read_json())
+        elif self.path.endswith("/images/generations"):
+            self._read_json()
+            if self._maybe_fail():
+                return
+            host, port = self.server.server_address[:2]
+            self._send_json(200, {
+                "created": int(time.time()),
+                "data": [{"url": f"http://{host}:{port}/images/{uuid.uuid4().hex}.png"}],
+            })
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_GET(self):
+        self.server.count(self.path)
+        if self.path.startswith("/images/"):
+            body = self.server.image_bytes
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def _chat(self, request: dict):
+        if self._maybe_fail():
+            return
+        cfg = self.config
+        n = min(cfg.completion_tokens, int(request.get("max_tokens") or cfg.completion_tokens))
+        words = [f"w{i} " for i in range(n)]
+        usage = {"prompt_tokens": cfg.prompt_tokens, "completion_tokens": n, "total_tokens": cfg.prompt_tokens + n}
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "created": int(time.time()), "model": request.get("model", "stub")}
+        if not request.get("stream"):
+            self._send_json(200, dict(base, object="chat.completion", usage=usage, choices=[{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(words)},
+                "finish_reason": "stop",
+            }]))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, word in enumerate(words):
+                chunk = dict(base, object="chat.completion.chunk", choices=[{
+                    "index": 0, "delta": {"content": word}, "finish_reason": "stop" if i == n - 1 else None,
+                }])
+                if i == n - 1:
+                    chunk["usage"] = usage
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+                time.sleep(cfg.stream_chunk_ms / 1000)
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前关闭了流（例如检测到关键词）
+            self.close_connection = True
+
+    def _write_chunk(self, text: str):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config: StubConfig):
+        super().__init__(address, StubHandler)
+        self.config = config
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._seed = random.Random(config.seed)
+        buf = io.BytesIO()
+        Image.new("RGB", (config.image_size, config.image_size), (90, 140, 200)).save(buf, format="PNG")
+        self.image_bytes = buf.getvalue()
+
+    def rng(self) -> random.Random:
+        """每个处理线程一个随机数生成器（由全局种子派生）"""
+        if not hasattr(self._local, "rng"):
+            with self._lock:
+                self._local.rng = random.Random(self._seed.random())
+        return self._local.rng
+
+    def count(self, path: str):
+        """按端点统计请求数（/images/<id>.png 合并为 /images）"""
+        key = "/images" if path.startswith("/images/") else path.split("?")[0]
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_stub_server(config: StubConfig = None, host: str = "127.0.0.1", port: int = 0) -> StubServer:
+    """在后台线程中启动桩服务，port=0 时自动选择空闲端口"""
+    server = StubServer((host, port), config or StubConfig())
+    threading.Thread(target=server.serve_forever, name="stub-server", daemon=True).start()
+    return server
+
+
+def add_config_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="延迟中位数（毫秒）")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="对数正态延迟的 sigma")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 429/5xx 的概率")
+    parser.add_argument("--completion-tokens", type=int, default=64)
+    parser.add_argument("--image-size", type=int, default=512)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def config_from_args(args) -> StubConfig:
+    return StubConfig(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        completion_tokens=args.completion_tokens,
+        image_size=args.image_size,
+        seed=args.seed,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI / ZhipuAI 兼容的本地桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_args(parser)
+    args = parser.parse_args(argv)
+    server = StubServer((args.host, args.port), config_from_args(args))
+    print(f"SILICON_BASE_URL={server.url}/v1")
+    print(f"ZHIPUAI_BASE_URL={server.url}/api/paas/v4")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,66 @@
+import time
+_START_TIME = time.perf_counter()  # 用于统计启动耗时，需在其余导入之前记录
 import tkinter as tk
 from tkinter import filedialog, ttk
-from PIL import Image, ImageTk
-from src.call_llm import get_image_generate, get_loss
-from src.loss import calculate_loss_with_image, calculate_loss_with_string
+from PIL import ImageTk
+from src.call_llm import request_image_url, download_image, get_loss
+from src.loss import calculate_loss_with_image, calculate_loss_with_string, get_clip_embedding, get_string_embedding, warm_up
+from src.attempt_store import AttemptStore
+from src.pipeline import GeneratePipeline
+from src.image_io import load_image, display_thumbnail
+from src.gallery import TargetGallery
+from src import metrics
 import os
+import queue
+import threading
+
+
+_placeholder = None
+
+
+def placeholder_image():
+    """The black placeholder image, decoded once and reused"""
+    global _placeholder
+    if _placeholder is None:
+        _placeholder = load_image('./black.png')
+    return _placeholder
+
+
+def combined_loss(img_loss, str_loss):
+    """Total loss combining image and semantic losses"""
+    return img_loss*0.2 + str_loss
+
+
+def make_stages(store, reuse_threshold=0.97):
+    """Build the pipeline generation and scoring stages around an attempt store"""
+
+    def generate_stage(prompt):
+        """Returns an image URL, a stored near-duplicate generation, or a placeholder for empty prompts"""
+        if prompt == '':
+            return placeholder_image()  # Fallback for empty prompts
+        duplicate = store.find_duplicate(get_string_embedding(prompt), reuse_threshold)
+        if duplicate is not None:
+            metrics.incr("game.image.reused")
+            image = store.load_image(duplicate)
+            image.info["reused_prompt"] = duplicate.prompt
+            return image
+        return request_image_url(prompt)
+
+    def score_stage(prompt, image, target):
+        """Image loss and semantic loss against the target; every scored attempt is recorded"""
+        with metrics.timer("game.image.score"):
+            img_loss = calculate_loss_with_image(target, image)  # Image loss
+            str_loss = calculate_loss_with_string(prompt, target)  # Semantic loss
+        if prompt != '':
+            with metrics.timer("game.image.record"):
+                store.add(
+                    prompt, image, target, img_loss, str_loss, combined_loss(img_loss, str_loss),
+                    get_string_embedding(prompt), get_clip_embedding(image),
+                )
+        return img_loss, str_loss
+
+    return generate_stage, score_stage
+
 
 class ImagePromptGame:
     def __init__(self, root):
@@ -58,6 +115,9 @@ class ImagePromptGame:
         
         self.generate_button = ttk.Button(button_frame, text="生成图片", command=self.generate_image, style="Generate.TButton", width=15)
         self.generate_button.pack(side=tk.LEFT)
+
+        self.gallery_button = ttk.Button(button_frame, text="加载目标目录", command=self.load_gallery, style="Accent.TButton", width=15)
+        self.gallery_button.pack(side=tk.LEFT, padx=(10, 0))
         
         # History counter and score
         score_frame = tk.Frame(button_frame, bg="#e1e8ed")
@@ -82,6 +142,10 @@ class ImagePromptGame:
         self.loss_indicator = tk.Canvas(self.loss_frame, width=20, height=20, bg="#f0f4f7", highlightthickness=0)
         self.loss_indicator.pack(side=tk.LEFT, padx=(10, 0))
         self.draw_loss_indicator("gray")
+
+        # Closest targets from the loaded gallery, if any
+        self.gallery_label = tk.Label(self.loss_frame, text="", font=("Arial", 11), bg="#f0f4f7", fg="#7f8c8d")
+        self.gallery_label.pack(side=tk.RIGHT)
         
         # Images frame
         self.image_frame = tk.Frame(root, bg="#f0f4f7")
@@ -115,10 +179,30 @@ class ImagePromptGame:
         self.generated_image = None
         self.best_loss = float('inf')
         self.attempts = 0
+        # Optional multi-target gallery; loaded off the Tk thread and handed over through a queue
+        self.gallery = None
+        self.gallery_events = queue.Queue()
         
         # Add keyboard shortcut
         self.root.bind('<Return>', lambda event: self.generate_image())
 
+        # Background generate -> download -> score pipeline, polled from the Tk loop
+        self.poll_interval_ms = 100
+        # Every attempt is kept in an append-only store; near-duplicate prompts reuse stored images
+        self.store = AttemptStore(".attempts")
+        generate_stage, score_stage = make_stages(self.store)
+        self.pipeline = GeneratePipeline(generate_stage, download_image, score_stage, max_in_flight=4)
+        self.root.after(self.poll_interval_ms, self.poll_results)
+
+        # Measure time until the window is first idle
+        self.startup_seconds = None
+        self.root.after_idle(self.record_startup_time)
+
+    def record_startup_time(self):
+        """Record how long it took for the window to become responsive"""
+        self.startup_seconds = time.perf_counter() - _START_TIME
+        metrics.observe("game.image.startup", self.startup_seconds)
+
     def configure_styles(self):
         """Configure custom styles for ttk widgets"""
         style = ttk.Style()
@@ -144,15 +228,20 @@ class ImagePromptGame:
 
     def load_image(self):
         """Load a target image from file system"""
+        # Warm up the CLIP model in the background while the file dialog is open
+        warm_up(background=True)
         file_path = filedialog.askopenfilename(
             filetypes=[("Image files", "*.jpg *.jpeg *.png *.bmp *.webp")]
         )
         if not file_path:
             return
         try:
-            self.target_image = Image.open(file_path)
+            # Fully decoded (JPEG draft mode, reduced size) so worker threads never race on lazy loading
+            self.target_image = load_image(file_path)
+            # Results for the previous target are no longer meaningful
+            self.pipeline.cancel_stale()
             self.display_image(self.target_image, self.target_canvas)
-            self.display_image(Image.open('./black.png'), self.generated_canvas)
+            self.display_image(placeholder_image(), self.generated_canvas)
             # Reset game state
             self.loss_label.config(text="当前 图像Loss: -- 当前 语义Loss: --")
             self.generated_canvas.config(image='')  # Reset canvas
@@ -165,28 +254,78 @@ class ImagePromptGame:
         except Exception as e:
             self.status_bar.config(text=f"错误: {str(e)}")
 
+    def load_gallery(self):
+        """Load a directory of targets; every generated image is then ranked against all of them"""
+        directory = filedialog.askdirectory()
+        if not directory:
+            return
+        warm_up(background=True)
+        self.gallery_button.config(state=tk.DISABLED)
+        self.status_bar.config(text=f"正在加载目标目录: {os.path.basename(directory)}")
+
+        def run():
+            try:
+                self.gallery_events.put(TargetGallery(directory))
+            except Exception as e:
+                self.gallery_events.put(e)
+        threading.Thread(target=run, name="gallery-load", daemon=True).start()
+
+    def handle_gallery(self, event):
+        """Install a loaded gallery (or report why loading failed)"""
+        self.gallery_button.config(state=tk.NORMAL)
+        if isinstance(event, Exception):
+            self.status_bar.config(text=f"加载目标目录错误: {str(event)}")
+            return
+        self.gallery = event
+        self.gallery_label.config(text=f"目标目录: {len(event)} 张")
+        self.status_bar.config(text=f"已加载 {len(event)} 张目标图（新编码 {event.encoded} 张），耗时 {event.load_seconds:.2f}s")
+
+    def show_gallery_matches(self, image, top=3):
+        """Rank a generated image against every gallery target in one matmul"""
+        if not self.gallery:
+            return
+        # The image embedding is already cached by the score stage, so this is a single matrix product
+        matches = self.gallery.rank_image(image, top)
+        self.gallery_label.config(text="目录最接近: " + ", ".join(f"{m.name} {m.similarity:.4f}" for m in matches))
+
     def generate_image(self):
-        """Generate an image based on the prompt"""
+        """Queue a prompt for generation; results arrive via poll_results"""
         prompt = self.prompt_entry.get().strip()
         if not self.target_image:
             self.status_bar.config(text="错误: 请先加载目标图片")
             return
-        self.status_bar.config(text=f"正在生成图片，请稍候...")  # Update status
-        self.root.update()  # Update the UI to reflect changes immediately
-        
+        self.pipeline.submit(prompt, self.target_image)
+        self.status_bar.config(text=f"正在生成图片，请稍候... (进行中: {self.pipeline.in_flight()})")
+
+    def poll_results(self):
+        """Drain finished pipeline jobs on the Tk main thread"""
         try:
-            # Generate the image using the prompt
-            if prompt == '':
-                self.generated_image = Image.open('./black.png')  # Fallback for empty prompts
-            else:
-                self.generated_image = get_image_generate(prompt)  # Call the existing image generation function
-            
-            # Display the generated image on the canvas
-            self.display_image(self.generated_image, self.generated_canvas)
+            while True:
+                self.handle_result(self.pipeline.results.get_nowait())
+        except queue.Empty:
+            pass
+        try:
+            while True:
+                self.handle_gallery(self.gallery_events.get_nowait())
+        except queue.Empty:
+            pass
+        self.root.after(self.poll_interval_ms, self.poll_results)
 
-            # Calculate losses
-            img_loss = calculate_loss_with_image(self.target_image, self.generated_image)  # Image loss
-            str_loss = calculate_loss_with_string(prompt, self.target_image)  # Semantic loss
+    def handle_result(self, result):
+        """Update the UI with one finished generation"""
+        # Queued before the target changed; its losses are against the old target
+        if self.pipeline.is_stale(result):
+            return
+        if result.error is not None:
+            self.status_bar.config(text=f"生成错误: {str(result.error)}")
+            return
+        prompt = result.prompt
+        self.generated_image = result.image
+        img_loss, str_loss = result.img_loss, result.str_loss
+        try:
+            # Display the generated image on the canvas
+            with metrics.timer("game.image.display"):
+                self.display_image(self.generated_image, self.generated_canvas)
 
             # Update attempts and display the losses
             self.attempts += 1
@@ -196,7 +335,11 @@ class ImagePromptGame:
             self.loss_label.config(text=f"当前图像 Loss: {img_loss:.4f}  当前语义 Loss: {str_loss:.4f}")
             
             # Update best loss if applicable
-            total_loss = img_loss*0.2 + str_loss  # Total loss combining both
+            total_loss = combined_loss(img_loss, str_loss)
+            pending = self.pipeline.in_flight()
+            suffix = f", 进行中: {pending}" if pending else ""
+            if "reused_prompt" in self.generated_image.info:
+                suffix += f", 复用历史生成: {self.generated_image.info['reused_prompt']}"
             if total_loss < self.best_loss:
                 self.best_loss = total_loss
                 self.best_loss_label.config(text=f"最佳 Loss: {total_loss:.4f}")
@@ -210,38 +353,40 @@ class ImagePromptGame:
                 self.draw_loss_indicator(color)
 
                 if total_loss < 0.3:
-                    self.status_bar.config(text=f"太棒了！你找到了一个非常接近的匹配 (Loss: {total_loss:.4f})")
+                    self.status_bar.config(text=f"太棒了！你找到了一个非常接近的匹配 (Loss: {total_loss:.4f}{suffix})")
                 else:
-                    self.status_bar.config(text=f"已生成图片 (Loss: {total_loss:.4f})")
+                    self.status_bar.config(text=f"已生成图片 (Loss: {total_loss:.4f}{suffix})")
             else:
-                self.status_bar.config(text=f"已生成图片 (Loss: {total_loss:.4f}, 非最佳)")
+                self.status_bar.config(text=f"已生成图片 (Loss: {total_loss:.4f}, 非最佳{suffix})")
                 self.draw_loss_indicator("orange")
+            self.show_gallery_matches(self.generated_image)
+            self.show_stage_breakdown(result)
     
         except Exception as e:
             self.status_bar.config(text=f"生成错误: {str(e)}")
 
+    def show_stage_breakdown(self, result):
+        """Append the per-stage timing of this round to the status bar (when metrics are enabled)"""
+        if not metrics.registry.enabled:
+            return
+        # Only this job's events: other in-flight jobs and gallery queries overlap in time
+        breakdown = metrics.format_breakdown(metrics.registry.breakdown(job=result.job_id))
+        self.status_bar.config(text=f"{self.status_bar.cget('text')}  [{result.elapsed * 1000:.0f}ms: {breakdown}]")
+
     def display_image(self, pil_image, canvas_label):
         """Display an image on the specified canvas"""
-        width, height = pil_image.size
-        max_size = 400
-        
-        if width > height:
-            new_width = max_size
-            new_height = int(height * (max_size / width))
+        # The padded 400px thumbnail is computed once per image and reused
+        display_img = display_thumbnail(pil_image, 400)
+
+        # Reuse the label's PhotoImage buffer (thumbnails are always 400x400) instead of
+        # allocating a new Tk image on every update
+        tk_image = getattr(canvas_label, "img", None)
+        if tk_image is not None and (tk_image.width(), tk_image.height()) == display_img.size:
+            tk_image.paste(display_img)
         else:
-            new_height = max_size
-            new_width = int(width * (max_size / height))
-            
-        resized = pil_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        
-        display_img = Image.new("RGB", (max_size, max_size), color="white")
-        
-        x_offset = (max_size - new_width) // 2
-        y_offset = (max_size - new_height) // 2
-        display_img.paste(resized, (x_offset, y_offset))
-        
-        tk_image = ImageTk.PhotoImage(display_img)
-        canvas_label.img = tk_image
+            tk_image = ImageTk.PhotoImage(display_img)
+            canvas_label.img = tk_image
+        # Cheap, and re-attaches the buffer if the label was cleared with config(image='')
         canvas_label.config(image=tk_image)
 
     def get_loss_color(self, loss):
@@ -266,3 +411,4 @@ if __name__ == "__main__":
     root = tk.Tk()
     app = ImagePromptGame(root)
     root.mainloop()
+    app.pipeline.shutdown()
@@ -1,7 +1,11 @@
 import tkinter as tk
 from tkinter import messagebox
-from src.call_llm import get_chat_completion
-import re
+from src import metrics
+from src.defense_game import AttackResult, DefenseGame, GameError, IllegalAttackError, evaluate_attack, SETUP, DEFENSE, ATTACK
+import os
+import queue
+import threading
+import time
 
 class PromptDefenseGame:
     def __init__(self, root):
@@ -10,14 +14,21 @@ class PromptDefenseGame:
         self.root.geometry("900x750")
         self.root.configure(bg="#f0f4f7")
 
-        self.keyword = ""
-        self.total_tokens = 0
-        self.time_left = 0
-        self.timer_running = False
-        self.phase = "setup"  # setup -> defense -> attack
-        self.round_time = 60
-        self.defense_time = 15 * 60
-        self.attack_history = []
+        # 游戏状态与阶段逻辑见 src/defense_game.py（与批量评测 src/attack_runner.py 共用）
+        # 单局 token 上限由环境变量 GAME_TOKEN_BUDGET 指定，不设置表示不限
+        # 攻击记录内存中只保留最近 500 条，全部记录写入 .cache/history/，界面按页读取
+        self.game = DefenseGame(
+            round_time=60, defense_time=15 * 60,
+            token_budget=int(os.getenv("GAME_TOKEN_BUDGET") or 0) or None,
+            history_path=os.path.join(".cache", "history", f"defense_{time.strftime('%Y%m%d_%H%M%S')}.jsonl"),
+        )
+        self.history_page_size = 50
+        self.history_page = 0
+        self.history_follow = True  # 停留在最后一页时自动跟随新记录
+        self.stream_queue = queue.Queue()
+        self.attack_running = False
+        self.attack_started_at = 0.0
+        self.poll_interval_ms = 50
 
         title_label = tk.Label(root, text="⚔️ 提示词攻防游戏 ⚔️", font=("Helvetica", 18, "bold"), bg="#f0f4f7")
         title_label.pack(pady=10)
@@ -63,76 +74,173 @@ class PromptDefenseGame:
         scrollbar.config(command=self.history_listbox.yview)
         scrollbar.pack(side="right", fill="y")
         self.history_listbox.config(yscrollcommand=scrollbar.set)
+        self.history_listbox.bind("<Double-Button-1>", self.show_history_entry)
+
+        # 列表框只放当前一页，翻页时从历史记录（内存或磁盘）读取
+        nav_frame = tk.Frame(history_frame, bg="#e9f0f5")
+        nav_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        tk.Button(nav_frame, text="上一页", command=lambda: self.show_history_page(self.history_page - 1)).pack(side=tk.LEFT)
+        tk.Button(nav_frame, text="下一页", command=lambda: self.show_history_page(self.history_page + 1)).pack(side=tk.LEFT)
+        tk.Button(nav_frame, text="最新", command=lambda: self.show_history_page(self.last_history_page())).pack(side=tk.LEFT)
+        self.history_page_label = tk.Label(nav_frame, text="第 1/1 页", bg="#e9f0f5")
+        self.history_page_label.pack(side=tk.LEFT, padx=10)
+
+        self.status_bar = tk.Label(root, text="", bd=1, relief=tk.SUNKEN, anchor=tk.W, padx=10)
+        self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
 
     def handle_button(self):
-        if self.phase == "setup":
-            self.keyword = self.keyword_entry.get().strip()
-            if not self.keyword:
-                messagebox.showwarning("输入不完整", "请填写关键词")
+        game = self.game
+        if game.phase == SETUP:
+            try:
+                game.set_keyword(self.keyword_entry.get())
+            except GameError as e:
+                messagebox.showwarning(e.title, e.message)
                 return
-            self.phase = "defense"
-            self.time_left = self.defense_time
-            self.timer_running = True
             self.result_text.insert(tk.END, "关键词设置成功，进入防守阶段！请在 15 分钟内设置防守提示词。\n")
             self.update_timer()
             self.action_button.config(text="提交防守提示词")
 
-        elif self.phase == "defense":
-            defense = self.defense_entry.get().strip()
-            if not defense:
-                messagebox.showwarning("提示词缺失", "请填写防守方提示词")
+        elif game.phase == DEFENSE:
+            try:
+                game.submit_defense(self.defense_entry.get())
+            except GameError as e:
+                messagebox.showwarning(e.title, e.message)
                 return
-            self.timer_running = False
-            self.phase = "attack"
-            self.result_text.insert(tk.END, f"已保存防守提示词：{defense}\n点击按钮开始攻击阶段。\n")
+            self.result_text.insert(tk.END, f"已保存防守提示词：{game.defense}\n点击按钮开始攻击阶段。\n")
             self.action_button.config(text="开始攻击")
 
-        elif self.phase == "attack":
-            if self.action_button.cget("text") == "开始攻击":
-                self.time_left = self.round_time
-                self.timer_running = True
+        elif game.phase == ATTACK:
+            if not game.attack_started:
+                game.start_attack()
                 self.result_text.insert(tk.END, "进入攻击阶段，每轮 60 秒。\n")
                 self.update_timer()
                 self.action_button.config(text="提交攻击提示词")
                 return
 
+            if self.attack_running:
+                return
             self.result_text.delete(1.0, tk.END)
-            defense = self.defense_entry.get().strip()
-            attack = self.attack_entry.get().strip()
+            # 防守提示词以输入框中的最新内容为准
+            game.defense = self.defense_entry.get().strip()
 
-            if not attack:
-                messagebox.showwarning("输入不完整", "请填写攻击提示词")
+            try:
+                attack = game.prepare_attack(self.attack_entry.get())
+            except IllegalAttackError as e:
+                messagebox.showerror(e.title, e.message)
                 return
+            except GameError as e:
+                messagebox.showwarning(e.title, e.message)
+                return
+
+            # 在后台线程中流式请求，文本块经队列回到界面线程；关键词一出现即终止生成
+            self.attack_running = True
+            self.action_button.config(state=tk.DISABLED)
+            self.result_text.insert(tk.END, "模型输出：\n")
+            keyword, defense = game.keyword, game.defense
+            self.attack_started_at = time.time()
 
-            for char in self.keyword:
-                if char in attack:
-                    messagebox.showerror("非法攻击提示", f"攻击提示不能包含关键词的任意字：'{char}'")
+            def run():
+                # 无论成功与否都要送回 "done"，否则按钮保持禁用、poll_stream 一直轮询
+                try:
+                    with metrics.timer("game.defense.attack"):
+                        result = evaluate_attack(
+                            keyword, defense, attack, stream=True,
+                            on_chunk=lambda chunk: self.stream_queue.put(("chunk", chunk)),
+                            budget=game.budget,
+                        )
+                except Exception as e:
+                    result = AttackResult(attack, error=str(e))
+                self.stream_queue.put(("done", result))
+            threading.Thread(target=run, daemon=True).start()
+            self.root.after(self.poll_interval_ms, self.poll_stream)
+
+    def poll_stream(self):
+        """把后台线程收到的文本块写入输出框，结束后显示判定结果"""
+        try:
+            while True:
+                kind, value = self.stream_queue.get_nowait()
+                if kind == "chunk":
+                    self.result_text.insert(tk.END, value)
+                    self.result_text.see(tk.END)
+                else:
+                    self.show_attack_result(value)
                     return
+        except queue.Empty:
+            pass
+        self.root.after(self.poll_interval_ms, self.poll_stream)
 
-            result = get_chat_completion(defense, attack)
-            if isinstance(result, tuple):
-                content, tokens = result
-            else:
-                content, tokens = result, None
-
-            keyword_present = self.keyword in content
-            self.result_text.insert(tk.END, f"模型输出：\n{content}\n\n")
-            self.result_text.insert(tk.END, f"关键词 \"{self.keyword}\" {'出现 ✅ 攻击成功' if keyword_present else '未出现 ❌ 防守成功'}\n")
-            if tokens:
-                self.total_tokens += tokens
-                self.result_text.insert(tk.END, f"本次生成 token 数：{tokens}\n")
-                self.token_label.config(text=f"总 token 数: {self.total_tokens}")
-
-            history_result = f"攻击词: {attack} -> {'成功 ✅' if keyword_present else '失败 ❌'}"
-            self.history_listbox.insert(tk.END, history_result)
-
-            self.time_left = self.round_time
-            self.timer_running = False
-            self.update_timer()
+    def show_attack_result(self, result):
+        game = self.game
+        game.finish_attack(result)
+        self.attack_running = False
+        self.action_button.config(state=tk.NORMAL)
+
+        keyword_present = result.success
+        if result.error:
+            self.result_text.insert(tk.END, f"请求失败：{result.error}\n")
+        self.result_text.insert(tk.END, "\n\n")
+        if result.aborted:
+            self.result_text.insert(tk.END, "（检测到关键词，已提前终止生成）\n")
+        self.result_text.insert(tk.END, f"关键词 \"{game.keyword}\" {'出现 ✅ 攻击成功' if keyword_present else '未出现 ❌ 防守成功'}\n")
+        if result.cached:
+            self.result_text.insert(tk.END, "（结果来自本地缓存，未消耗 token）\n")
+        elif result.tokens:
+            self.result_text.insert(tk.END, f"本次 token 数：输入 {result.prompt_tokens or '?'}，生成 {result.tokens}（上限 {result.max_tokens or '?'}）\n")
+            self.token_label.config(text=f"总 token 数: {game.total_tokens}")
+        if result.truncated:
+            self.result_text.insert(tk.END, "（输出达到 max_tokens 上限被截断）\n")
+
+        if self.history_follow:
+            self.show_history_page(self.last_history_page())
+        else:
+            self.update_history_label()
+
+        if metrics.registry.enabled:
+            breakdown = metrics.registry.breakdown(since=self.attack_started_at)
+            self.status_bar.config(text=f"本次耗时 {result.latency * 1000:.0f}ms: {metrics.format_breakdown(breakdown)}")
+
+        self.update_timer()
+
+    def format_history_entry(self, index, result):
+        return f"#{index + 1} 攻击词: {result.attack} -> {'成功 ✅' if result.success else '失败 ❌'}"
+
+    def last_history_page(self):
+        return max(0, (len(self.game.attack_history) - 1) // self.history_page_size)
+
+    def show_history_page(self, page):
+        """只把一页记录放进列表框；停留在最后一页且只新增了一条时直接追加"""
+        history = self.game.attack_history
+        page = min(max(page, 0), self.last_history_page())
+        start = page * self.history_page_size
+        shown = self.history_listbox.size()
+        if page == self.history_page and shown and start + shown == len(history) - 1:
+            self.history_listbox.insert(tk.END, self.format_history_entry(len(history) - 1, history[-1]))
+        else:
+            self.history_listbox.delete(0, tk.END)
+            for offset, result in enumerate(history.page(start, self.history_page_size)):
+                self.history_listbox.insert(tk.END, self.format_history_entry(start + offset, result))
+        self.history_page = page
+        self.history_follow = page == self.last_history_page()
+        if self.history_follow:
+            self.history_listbox.see(tk.END)
+        self.update_history_label()
+
+    def update_history_label(self):
+        self.history_page_label.config(
+            text=f"第 {self.history_page + 1}/{self.last_history_page() + 1} 页，共 {len(self.game.attack_history)} 条"
+        )
+
+    def show_history_entry(self, event=None):
+        """双击历史记录时在输出框显示该次攻击的完整内容"""
+        selection = self.history_listbox.curselection()
+        if not selection:
+            return
+        result = self.game.attack_history[self.history_page * self.history_page_size + selection[0]]
+        self.result_text.delete(1.0, tk.END)
+        self.result_text.insert(tk.END, f"攻击词：{result.attack}\n\n模型输出：\n{result.content or result.error or ''}\n")
 
     def stop_timer(self):
-        self.timer_running = not self.timer_running
-        if self.timer_running == False:
+        if self.game.toggle_timer() == False:
             self.result_text.insert(tk.END, "⏸️ 计时已停止\n")
             self.stop_timer_button.config(text="恢复计时")
         else:
@@ -141,22 +249,21 @@ class PromptDefenseGame:
             self.stop_timer_button.config(text="停止计时")
 
     def update_timer(self):
-        if self.timer_running and self.time_left > 0:
-            minutes = self.time_left // 60
-            seconds = self.time_left % 60
+        game = self.game
+        if game.timer_running and game.time_left > 0:
+            minutes = game.time_left // 60
+            seconds = game.time_left % 60
             self.timer_label.config(text=f"剩余时间: {minutes:02d}:{seconds:02d}")
-            self.time_left -= 1
+            game.tick()
             self.root.after(1000, self.update_timer)
-        elif self.time_left == 0:
+        elif game.time_left == 0:
             self.timer_label.config(text="时间到 ⏰")
-            if self.phase == "defense":
-                self.phase = "attack"
-                self.timer_running = True
-                self.time_left = self.round_time
+            event = game.tick()
+            if event == "defense_timeout":
                 self.result_text.insert(tk.END, "防守阶段时间结束，进入攻击阶段。\n")
                 self.action_button.config(text="提交攻击提示词")
                 self.update_timer()
-            elif self.phase == "attack":
+            elif event == "attack_timeout":
                 self.result_text.insert(tk.END, "攻击本轮时间结束。可以继续下一轮攻击。\n")
 
 if __name__ == "__main__":
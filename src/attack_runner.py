@@ -0,0 +1,157 @@
+"""
+无界面的并发攻击评测：
+
+    python -m src.attack_runner --keyword 苹果 --defense defense.txt --attacks attacks.txt --out results.jsonl
+
+attacks 文件每行一条攻击提示词；以 .jsonl 结尾（或指定 --format jsonl）时每行是带 "attack" 字段的 JSON。
+格式按整个文件确定，纯文本文件中以 "{" 开头的攻击词原样使用。
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from src.defense_game import AttackResult, evaluate_attack, find_forbidden_char
+from src.token_budget import TokenBudget, format_report, planner
+
+
+class RateLimiter:
+    """令牌桶限速器（线程安全），rate 为每秒请求数，<= 0 表示不限速"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+ATTACK_FORMATS = ("text", "jsonl")
+
+
+def load_attacks(path: str, fmt: Optional[str] = None) -> List[str]:
+    """
+    参数:
+        fmt: "text" 或 "jsonl"，None 时按扩展名判断（.jsonl 为 jsonl，其余为纯文本）
+    """
+    if fmt is None:
+        fmt = "jsonl" if path.lower().endswith(".jsonl") else "text"
+    if fmt not in ATTACK_FORMATS:
+        raise ValueError(f"unknown attacks format {fmt!r}, expected one of {', '.join(ATTACK_FORMATS)}")
+    attacks = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if fmt == "jsonl":
+                try:
+                    line = json.loads(line)["attack"]
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f"{path}:{number}: expected a JSON object with an \"attack\" field") from e
+            attacks.append(line)
+    return attacks
+
+
+def run_attacks(
+    keyword: str,
+    defense: str,
+    attacks: Iterable[str],
+    concurrency: int = 8,
+    rate: float = 0.0,
+    complete: Optional[Callable] = None,
+    budget: Optional[TokenBudget] = None,
+) -> Iterator[AttackResult]:
+    """
+    并发评测多条攻击提示词，按完成顺序逐条产出结果
+
+    参数:
+        keyword: 关键词
+        defense: 防守提示词
+        attacks: 攻击提示词
+        concurrency: 同时进行的请求数
+        rate: 每秒最多发起的请求数，0 表示不限速
+        complete: 聊天补全函数，默认使用 get_chat_completion
+        budget: 本次评测的 token 预算，用完后剩余攻击直接返回错误
+    """
+    limiter = RateLimiter(rate, burst=concurrency)
+
+    def run_one(attack: str) -> AttackResult:
+        char = find_forbidden_char(keyword, attack)
+        if char is not None:
+            return AttackResult(attack, error=f"攻击提示不能包含关键词的任意字：'{char}'")
+        limiter.acquire()
+        return evaluate_attack(keyword, defense, attack, complete, budget=budget)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run_one, attack.strip()) for attack in attacks if attack.strip()]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _read_text_arg(value: str) -> str:
+    """参数若是存在的文件路径则读取文件内容"""
+    if os.path.isfile(value):
+        with open(value, encoding="utf-8") as f:
+            return f.read().strip()
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="并发评测防守提示词")
+    parser.add_argument("--keyword", required=True, help="关键词（防守目标）")
+    parser.add_argument("--defense", required=True, help="防守提示词，或包含提示词的文件路径")
+    parser.add_argument("--attacks", required=True, help="攻击提示词文件，每行一条")
+    parser.add_argument("--format", choices=ATTACK_FORMATS, help="attacks 文件格式，默认按扩展名判断（.jsonl 为 jsonl）")
+    parser.add_argument("--out", default="-", help="结果 JSONL 输出路径，默认输出到标准输出")
+    parser.add_argument("--concurrency", type=int, default=8, help="最大并发请求数")
+    parser.add_argument("--rate", type=float, default=0.0, help="每秒最大请求数，0 表示不限速")
+    parser.add_argument("--budget", type=int, help="本次评测的 token 上限（prompt + 输出）")
+    args = parser.parse_args(argv)
+
+    attacks = load_attacks(args.attacks, args.format)
+    defense = _read_text_arg(args.defense)
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+    start = time.perf_counter()
+    succeeded = tokens = done = 0
+    try:
+        budget = TokenBudget(args.budget, "本次评测")
+        for result in run_attacks(args.keyword, defense, attacks, args.concurrency, args.rate, budget=budget):
+            out.write(json.dumps(result.to_dict(), ensure_ascii=False) + "\n")
+            out.flush()
+            done += 1
+            succeeded += result.success
+            if not result.cached:
+                tokens += (result.prompt_tokens or 0) + (result.tokens or 0)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start
+    print(
+        f"完成 {done} 条攻击，成功 {succeeded} 条，共 {tokens} token，"
+        f"耗时 {elapsed:.1f}s（{done / elapsed if elapsed else 0:.2f} 条/秒）",
+        file=sys.stderr,
+    )
+    print(format_report(planner.report()), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import bisect
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from src import image_io
+from src.embedding_cache import image_key
+
+
+@dataclass
+class Attempt:
+    attempt_id: int
+    ts: float
+    prompt: str
+    image: str           # 图片内容的 sha256，对应 images/<sha256>.png
+    target: str          # 目标图的内容哈希
+    img_loss: float
+    str_loss: float
+    total_loss: float
+
+
+def content_id(img: Image.Image) -> str:
+    """图片内容哈希（每个图片对象只计算一次）"""
+    return image_io.derived(img, "content_id", lambda: image_key(img))
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    return (x / max(float(np.linalg.norm(x)), 1e-12)).astype(np.float32)
+
+
+class AttemptStore:
+    """
+    只追加的尝试记录：
+
+        <root>/images/<sha256>.png   生成图片（按内容寻址，重复图片只存一份）
+        <root>/attempts.jsonl        每次尝试的元数据
+        <root>/embeddings.f32        与 attempts.jsonl 逐行对应的 [提示词嵌入, 图片嵌入]（已归一化）
+        <root>/meta.json             嵌入维度
+
+    嵌入在内存中保存为连续矩阵，近邻查询是一次矩阵-向量乘法；
+    排行榜按 total_loss 维护有序列表，最佳和前 k 名查询无需扫描。
+    """
+
+    def __init__(self, root: str = ".attempts"):
+        self.root = root
+        self.image_dir = os.path.join(root, "images")
+        self.records_path = os.path.join(root, "attempts.jsonl")
+        self.embeddings_path = os.path.join(root, "embeddings.f32")
+        self.meta_path = os.path.join(root, "meta.json")
+        os.makedirs(self.image_dir, exist_ok=True)
+        self.records: List[Attempt] = []
+        self.dim = None
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._ranked = {}  # target -> 有序 [(total_loss, attempt_id)]；None 表示所有目标
+        self._lock = threading.Lock()
+        self._load()
+
+    # ---- 持久化 ----
+
+    def _load(self):
+        records = []
+        ends = []  # 每条记录在 attempts.jsonl 中的结束偏移
+        if os.path.exists(self.records_path):
+            with open(self.records_path, "rb") as f:
+                offset = 0
+                for line in f:
+                    offset += len(line)
+                    if line.strip():
+                        try:
+                            record = Attempt(**json.loads(line))
+                        except (ValueError, TypeError):
+                            break  # 写入中途崩溃留下的半行，连同之后的内容一起丢弃
+                        records.append(record)
+                        ends.append(offset)
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+        n = 0
+        if self.dim and os.path.exists(self.embeddings_path):
+            width = 2 * self.dim
+            flat = np.fromfile(self.embeddings_path, dtype=np.float32)
+            # 写入中途崩溃时以两者中较短的为准
+            n = min(len(records), flat.size // width)
+            if n:
+                self._reserve(n)
+                self._matrix[:n] = flat[: n * width].reshape(n, width)
+        # 两个文件都截到 n 条：之后追加的 attempt_id 从 n 开始，不会与残留记录重复或错位
+        # （缺少 meta.json 时维度未知，已有的嵌入无法使用，n 为 0）
+        if os.path.exists(self.embeddings_path):
+            keep = n * 2 * self.dim * np.dtype(np.float32).itemsize if self.dim else 0
+            if os.path.getsize(self.embeddings_path) > keep:
+                with open(self.embeddings_path, "r+b") as f:
+                    f.truncate(keep)
+        if os.path.exists(self.records_path):
+            keep = ends[n - 1] if n else 0
+            if os.path.getsize(self.records_path) > keep:
+                with open(self.records_path, "r+b") as f:
+                    f.truncate(keep)
+        records = records[:n]
+        for record in records:
+            self._index(record)
+
+    def _reserve(self, n: int):
+        """按倍增策略扩容嵌入矩阵，避免每次追加都整体复制"""
+        if self._matrix.shape[0] >= n and self._matrix.shape[1] == 2 * self.dim:
+            return
+        capacity = max(64, self._matrix.shape[0])
+        while capacity < n:
+            capacity *= 2
+        matrix = np.zeros((capacity, 2 * self.dim), dtype=np.float32)
+        if self._matrix.shape[1] == 2 * self.dim:
+            matrix[: len(self.records)] = self._matrix[: len(self.records)]
+        self._matrix = matrix
+
+    def _index(self, record: Attempt):
+        self.records.append(record)
+        for key in (None, record.target):
+            ranked = self._ranked.setdefault(key, [])
+            bisect.insort(ranked, (record.total_loss, record.attempt_id))
+
+    def _save_image(self, image: Image.Image) -> str:
+        buf = io.BytesIO()
+        image.save(buf, format="PNG")
+        data = buf.getvalue()
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.image_dir, f"{digest}.png")
+        if not os.path.exists(path):
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    # ---- 写入 ----
+
+    def add(
+        self,
+        prompt: str,
+        image: Image.Image,
+        target: Image.Image,
+        img_loss: float,
+        str_loss: float,
+        total_loss: float,
+        prompt_embedding: np.ndarray,
+        image_embedding: np.ndarray,
+    ) -> Attempt:
+        digest = self._save_image(image)
+        row = np.concatenate([_normalize(prompt_embedding), _normalize(image_embedding)])
+        with self._lock:
+            if self.dim is None:
+                self.dim = row.size // 2
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim}, f)
+            record = Attempt(
+                len(self.records), time.time(), prompt, digest, content_id(target),
+                float(img_loss), float(str_loss), float(total_loss),
+            )
+            self._reserve(len(self.records) + 1)
+            self._matrix[len(self.records)] = row
+            # 先写嵌入再写元数据：加载时以较短者为准，崩溃不会产生错位
+            with open(self.embeddings_path, "ab") as f:
+                f.write(row.tobytes())
+            with open(self.records_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(asdict(record), ensure_ascii=False) + "\n")
+            self._index(record)
+        return record
+
+    # ---- 查询 ----
+
+    def load_image(self, record: Attempt) -> Image.Image:
+        return image_io.load_image(os.path.join(self.image_dir, f"{record.image}.png"), max_side=None)
+
+    def _nearest(self, embedding: np.ndarray, offset: int, k: int) -> List[Tuple[float, Attempt]]:
+        with self._lock:
+            n = len(self.records)
+            if n == 0 or self.dim is None:
+                return []
+            sims = self._matrix[:n, offset:offset + self.dim] @ _normalize(embedding)
+            records = self.records
+        k = min(k, n)
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return [(float(sims[i]), records[i]) for i in top]
+
+    def nearest_prompts(self, prompt_embedding: np.ndarray, k: int = 5) -> List[Tuple[float, Attempt]]:
+        """按提示词嵌入的余弦相似度返回前 k 个历史尝试"""
+        return self._nearest(prompt_embedding, 0, k)
+
+    def nearest_images(self, image_embedding: np.ndarray, k: int = 5) -> List[Tuple[float, Attempt]]:
+        """按生成图片嵌入的余弦相似度返回前 k 个历史尝试"""
+        return self._nearest(image_embedding, self.dim or 0, k)
+
+    def find_duplicate(self, prompt_embedding: np.ndarray, threshold: float = 0.97) -> Optional[Attempt]:
+        """找到足够相近的历史提示词时返回该尝试，可直接复用其生成图片"""
+        hits = self.nearest_prompts(prompt_embedding, 1)
+        if hits and hits[0][0] >= threshold:
+            return hits[0][1]
+        return None
+
+    def leaderboard(self, target: Optional[Image.Image] = None, k: int = 10) -> List[Attempt]:
+        """total_loss 最小的前 k 次尝试，target 为 None 时统计所有目标"""
+        key = None if target is None else content_id(target)
+        with self._lock:
+            ranked = self._ranked.get(key, [])[:k]
+            return [self.records[i] for _, i in ranked]
+
+    def best(self, target: Optional[Image.Image] = None) -> Optional[Attempt]:
+        top = self.leaderboard(target, 1)
+        return top[0] if top else None
+
+    def __len__(self) -> int:
+        return len(self.records)
@@ -1,79 +1,283 @@
-from openai import OpenAI
-from zhipuai import ZhipuAI
-from typing import Generator, Union
+from typing import Generator, NamedTuple, Optional, Union
 import os
-import requests
+import time
 from PIL import Image
+from src import cassette, image_io, metrics, pixel_loss
+from src.clients import pool
+from src.response_cache import ResponseCache, make_key
+from src.token_budget import Plan, TokenBudget, planner
 chat_model = "THUDM/GLM-4-32B-0414"
 img_model = "cogview-4-250304"
 
 def get_loss(Image1:Image, Image2:Image) -> float:
     """
-    计算两张图片之间的损失
+    计算两张图片之间的损失（向量化实现，见 src/pixel_loss.py）
     """
-    # 将图片转换为RGB模式
-    Image1 = Image1.convert("RGB")
-    Image2 = Image2.convert("RGB")
-    
-    # 获取图片的像素数据
-    pixels1 = list(Image1.getdata())
-    pixels2 = list(Image2.getdata())
-    
-    # 计算损失
-    loss = sum(abs(p1[0]- p2[0])+abs(p1[1]-p2[1])+abs(p1[2]-p2[2]) for p1, p2 in zip(pixels1, pixels2)) / len(pixels1)
+    with metrics.timer("pixel.loss"):
+        return pixel_loss.get_loss(Image1, Image2)
+
+def request_image_url(prompt: str) -> str:
+    """调用文生图接口，返回生成图片的 URL（启用 cassette 时录制 / 回放，见 src/cassette.py）"""
+    tape = cassette.active()
+    key = cassette.Cassette.key("image", img_model, prompt)
+    if tape is not None and tape.mode == cassette.REPLAY:
+        entry = tape.lookup(key)
+        tape.wait(entry["latency"])
+        return entry["response"]["url"]
+    client = pool.zhipu()  # 复用的客户端，API Key 见 src/clients.py
     
-    return loss
+    start = time.perf_counter()
+    with metrics.timer("image.request"):
+        response = pool.call_with_retry(lambda: client.images.generations(
+            model=img_model, #填写需要调用的模型编码
+            prompt=prompt,
+        ))
+    url = response.data[0].url
+    if tape is not None:
+        tape.record("image", key, {"model": img_model, "prompt": prompt}, {"url": url}, time.perf_counter() - start)
+    return url
+
+def _download(url: str) -> bytes:
+    tape = cassette.active()
+    key = cassette.Cassette.key("download", url)
+    if tape is not None and tape.mode == cassette.REPLAY:
+        entry = tape.lookup(key)
+        tape.wait(entry["latency"])
+        return tape.blob(entry["response"]["blob"])
+    start = time.perf_counter()
+    data = pool.download(url)
+    if tape is not None:
+        tape.record("download", key, {"url": url}, {"bytes": len(data)}, time.perf_counter() - start, blob=data)
+    return data
+
+def download_image(url: str) -> Image:
+    """完整下载到内存后再解码图片"""
+    with metrics.timer("image.download"):
+        data = _download(url)
+    with metrics.timer("image.decode"):
+        return image_io.decode_bytes(data)
 
 def get_image_generate(prompt: str, max_tokens: int = 2000) -> Image:
-    client = ZhipuAI(api_key="06d3a1bc08516b363099cd9826143c8d.FjukLsi1czNirl4d") # 请填写您自己的APIKey
-    
-    response = client.images.generations(
-        model=img_model, #填写需要调用的模型编码
-        prompt=prompt,
-    )
-    url=response.data[0].url
-    image = Image.open(requests.get(url, stream=True).raw)
-    return image
+    return download_image(request_image_url(prompt))
 
 def get_client():
-    silicon_api_key = os.getenv("SILICON_API_KEY")
-    return OpenAI(
-        api_key=silicon_api_key,
-        base_url="https://api.siliconflow.cn/v1",
-    )
+    return pool.openai()
+
+def get_pool_stats() -> dict:
+    """连接复用、重试等统计"""
+    return pool.stats()
+
+class ChatResult(NamedTuple):
+    content: str
+    completion_tokens: Optional[int]
+    cached: bool = False
+    prompt_tokens: Optional[int] = None
+    truncated: bool = False  # 输出因 max_tokens 被截断
+    max_tokens: Optional[int] = None
+
+_response_cache = None
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    懒加载的补全结果缓存，路径由 LLM_CACHE_PATH 指定（设为空字符串可关闭）
+    """
+    global _response_cache
+    path = os.getenv("LLM_CACHE_PATH", ".cache/chat_responses.sqlite")
+    # 录制 / 回放时每次调用都要经过 cassette
+    if not path or cassette.active() is not None:
+        return None
+    if _response_cache is None:
+        _response_cache = ResponseCache(path)
+    return _response_cache
+
+def _cache_lookup(cache: Optional[ResponseCache], key: str) -> Optional[ChatResult]:
+    if cache is None:
+        return None
+    with metrics.timer("chat.cache_lookup"):
+        hit = cache.get(key)
+    if hit is None:
+        metrics.incr("chat.cache_miss")
+        return None
+    metrics.incr("chat.cache_hit")
+    return ChatResult(hit[0], hit[1], True)
+
+def _plan(messages: list, max_tokens: Optional[int], budget: Optional[TokenBudget]) -> Plan:
+    """发送前估算 prompt 大小、选定 max_tokens 并预留预算（见 src/token_budget.py）"""
+    plan = planner.plan(messages[0]["content"], messages[1]["content"], budget, max_tokens)
+    return plan
+
+def _create_chat(messages: list, max_tokens: int, stream: bool = False):
+    """
+    发出补全请求；启用 cassette 时录制或回放，返回的对象与 openai 的响应结构相同
+    """
+    tape = cassette.active()
+    key = cassette.Cassette.key("chat", chat_model, messages[0]["content"], messages[1]["content"])
+    if tape is not None and tape.mode == cassette.REPLAY:
+        return cassette.replay_chat(tape, key, stream)
+    client = get_client()
+    options = {"stream": True, "stream_options": {"include_usage": True}} if stream else {}
+    start = time.perf_counter()
+    response = pool.call_with_retry(lambda: client.chat.completions.create(
+        model=chat_model,
+        messages=messages,
+        temperature=0.0,
+        max_tokens=max_tokens,
+        **options,
+    ))
+    if tape is None:
+        return response
+    request = {"model": chat_model, "messages": messages, "max_tokens": max_tokens, "stream": stream}
+    if stream:
+        return cassette.RecordingStream(tape, key, request, response, start)
+    tape.record("chat", key, request, cassette.chat_response(response), time.perf_counter() - start)
+    return response
+
+class ChatStream:
+    """
+    流式补全：逐块产出文本，返回值（StopIteration.value）为 ChatResult。
+    调用方提前 close() 时拿不到返回值，可读取 cached / estimated_prompt_tokens / max_tokens（产出第一块后已确定）
+    """
+
+    def __init__(self, messages: list, max_tokens: Optional[int], budget: Optional[TokenBudget],
+                 cache: Optional[ResponseCache], key: str):
+        self.cached = False
+        self.estimated_prompt_tokens = None
+        self.max_tokens = None
+        self._gen = _stream_chat_completion(messages, max_tokens, budget, cache, key, self)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        return next(self._gen)
+
+    def close(self):
+        self._gen.close()
+
+
+def _stream_chat_completion(
+    messages: list,
+    max_tokens: Optional[int],
+    budget: Optional[TokenBudget],
+    cache: Optional[ResponseCache],
+    key: str,
+    state: ChatStream,
+) -> Generator[str, None, Optional[ChatResult]]:
+    """
+    流式输出版本：逐块产出文本，生成器的返回值（StopIteration.value）为 ChatResult，出错时为 None
+    （与非流式版本相同，连接和读取过程中的异常都不会抛给调用方）。
+    调用方提前 close() 生成器时会关闭底层连接，不再继续生成；未完整结束的结果不写入缓存。
+    """
+    hit = _cache_lookup(cache, key)
+    if hit is not None:
+        state.cached = True
+        yield hit.content
+        return hit
+    plan = _plan(messages, max_tokens, budget)
+    state.estimated_prompt_tokens = plan.estimated_prompt_tokens
+    state.max_tokens = plan.max_tokens
+    start = time.perf_counter()
+    try:
+        with metrics.timer("chat.connect"):
+            response = _create_chat(messages, plan.max_tokens, stream=True)
+    except Exception as e:
+        planner.cancel(plan)
+        metrics.incr("chat.error")
+        print(f"Error: {e}")
+        return None
+    parts = []
+    tokens = prompt_tokens = None
+    finish_reason = None
+    completed = False
+    try:
+        for chunk in response:
+            if getattr(chunk, "usage", None):
+                tokens = chunk.usage.completion_tokens
+                prompt_tokens = chunk.usage.prompt_tokens
+            if chunk.choices:
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                if chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield parts[-1]
+        completed = True
+    except Exception as e:
+        # 读取超时、连接中断或服务端在流中返回的错误；已产出的块保留在调用方
+        metrics.incr("chat.error")
+        print(f"Error: {e}")
+        return None
+    finally:
+        if not completed:
+            response.close()
+            metrics.incr("chat.stream_aborted")
+            # 提前终止时没有 usage，以已收到的块数近似
+            planner.settle(plan, prompt_tokens, tokens or len(parts), complete=False)
+        metrics.observe("chat.stream", time.perf_counter() - start)
+    content = "".join(parts)
+    if tokens is None:
+        tokens = len(parts)  # 服务端未返回 usage 时，以块数近似 token 数
+    truncated = finish_reason == "length"
+    planner.settle(plan, prompt_tokens, tokens, truncated)
+    # 未截断的输出与 max_tokens 无关，可以缓存
+    if cache is not None and not truncated:
+        cache.put(key, content, tokens)
+    return ChatResult(content, tokens, False, prompt_tokens, truncated, plan.max_tokens)
+
 
 def get_chat_completion(
     user_prompt: str,
     user_context: str,
-    max_tokens: int = 2000,
-) -> Union[str, Generator[str, None, None]]:
+    max_tokens: Optional[int] = None,
+    use_cache: bool = True,
+    use_stream: bool = False,
+    budget: Optional[TokenBudget] = None,
+) -> Union[ChatResult, ChatStream, None]:
     """
     获取聊天补全结果，支持流式和非流式输出
 
     参数:
         user_prompt: 用户提示
         user_context: 用户上下文
+        max_tokens: 最大token数，None 表示根据最近的输出长度自适应选取（见 src/token_budget.py）
+        use_cache: 是否使用本地缓存（temperature=0，相同输入的结果相同）
         use_stream: 是否使用流式输出
-        max_tokens: 最大token数
+        budget: 额外检查的预算（例如单局预算），全局预算总是会检查
 
     返回:
-        如果 use_stream=True: 返回一个生成器，逐块产生响应
-        如果 use_stream=False: 返回完整的响应字符串
+        如果 use_stream=True: 返回一个生成器，逐块产生响应，结束时返回 ChatResult
+        如果 use_stream=False: 返回 ChatResult(内容, completion token 数, 是否来自缓存, prompt token 数, 是否截断, max_tokens)
+
+    预算不足时抛出 BudgetExceededError（流式输出在第一次迭代时抛出）
     """
-    client = get_client()
+    cache = get_response_cache() if use_cache else None
+    # 只缓存未截断的输出，与 max_tokens 无关，因此不放进缓存键
+    key = make_key(chat_model, user_prompt, user_context)
+    messages = [{"role":"system","content":user_prompt},{"role": "user", "content": user_context}]
+    if use_stream:
+        return ChatStream(messages, max_tokens, budget, cache, key)
+    hit = _cache_lookup(cache, key)
+    if hit is not None:
+        return hit
+    plan = _plan(messages, max_tokens, budget)
     try:
             # 非流式输出版本
-        response = client.chat.completions.create(
-                model=chat_model,
-                messages=[{"role":"system","content":user_prompt},{"role": "user", "content": user_context}],
-                temperature=0.0,
-                max_tokens=max_tokens,
-            )
-        return response.choices[0].message.content,response.usage.completion_tokens
+        with metrics.timer("chat.request"):
+            response = _create_chat(messages, plan.max_tokens)
+        usage = response.usage
+        truncated = response.choices[0].finish_reason == "length"
+        result = ChatResult(
+            response.choices[0].message.content, usage.completion_tokens, False,
+            usage.prompt_tokens, truncated, plan.max_tokens,
+        )
 
     except Exception as e:
+        planner.cancel(plan)
+        metrics.incr("chat.error")
         print(f"Error: {e}")
-        return None 
+        return None
+    planner.settle(plan, result.prompt_tokens, result.completion_tokens, truncated)
+    if cache is not None and result.content is not None and not truncated:
+        cache.put(key, result.content, result.completion_tokens)
+    return result
 
 if __name__ == "__main__":
     # 测试代码
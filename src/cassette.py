@@ -0,0 +1,321 @@
+"""
+外部调用的录制 / 回放（cassette），用于离线、可重复的性能对比：
+
+    LLM_CASSETTE=runs/game.jsonl.gz LLM_CASSETTE_MODE=record python main.py
+    LLM_CASSETTE=runs/game.jsonl.gz LLM_CASSETTE_MODE=replay LLM_CASSETTE_TIMING=1 python main.py
+    python -m src.cassette runs/game.jsonl.gz        # 查看录制内容
+
+录制的内容包括聊天补全的请求、输出（流式输出按块记录到达时间）、token 用量、
+文生图返回的 URL、下载的图片字节和每次调用的耗时。回放时按请求内容匹配，同一请求多次出现时按录制顺序依次返回，
+用完后重复最后一次；LLM_CASSETTE_TIMING=1 时按录制的耗时等待，否则立即返回。
+
+cassette 文件是只追加的 JSONL（以 .gz 结尾时 gzip 压缩），图片按内容哈希只保存一份。
+录制时文件保持打开，每条记录写入后 flush；进程退出或 stop() 时关闭。
+启用 cassette 时本地补全缓存（LLM_CACHE_PATH）不生效，保证每次调用都经过录制 / 回放。
+"""
+import argparse
+import atexit
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from src import metrics
+from src.response_cache import make_key
+
+RECORD = "record"
+REPLAY = "replay"
+
+
+class CassetteMissError(LookupError):
+    """回放模式下没有找到对应的录制"""
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class Cassette:
+    """
+    参数:
+        path: cassette 文件路径
+        mode: "record" 追加录制，"replay" 只读回放
+        timing: 回放时按录制的耗时等待
+    """
+
+    def __init__(self, path: str, mode: str = REPLAY, timing: bool = False):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"unknown cassette mode {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.timing = timing
+        self.entries: Dict[str, List[dict]] = defaultdict(list)
+        self.blobs: Dict[str, bytes] = {}
+        self._cursor: Dict[str, int] = defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self._lock = threading.Lock()
+        self._writer = None
+        if os.path.exists(path):
+            self._load()
+        elif mode == REPLAY:
+            raise FileNotFoundError(path)
+        elif os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def _load(self):
+        with _open(self.path, "r") as f:
+            try:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if record["type"] == "blob":
+                        self.blobs[record["sha"]] = base64.b64decode(record["data"])
+                    else:
+                        self.entries[record["key"]].append(record)
+            except EOFError:
+                # 录制进程没有正常关闭时 gzip 缺少结尾，已 flush 的记录仍可读出
+                pass
+
+    @staticmethod
+    def key(kind: str, *parts) -> str:
+        return make_key(kind, *parts)
+
+    # ---- 回放 ----
+
+    def lookup(self, key: str) -> dict:
+        with self._lock:
+            entries = self.entries.get(key)
+            if not entries:
+                self.misses += 1
+                metrics.incr("cassette.miss")
+                raise CassetteMissError(f"no recorded response in {self.path} for request {key[:12]}")
+            i = self._cursor[key]
+            self._cursor[key] = i + 1
+            self.hits += 1
+        metrics.incr("cassette.hit")
+        return entries[min(i, len(entries) - 1)]
+
+    def wait(self, seconds: float):
+        """回放时按录制的耗时等待（未开启 timing 时直接返回）"""
+        if self.timing and seconds > 0:
+            time.sleep(seconds)
+
+    def blob(self, sha: str) -> bytes:
+        return self.blobs[sha]
+
+    # ---- 录制 ----
+
+    def record(self, kind: str, key: str, request: dict, response: dict, latency: float, blob: bytes = None):
+        record = {"type": kind, "key": key, "request": request, "response": response, "latency": round(latency, 6)}
+        lines = []
+        with self._lock:
+            if blob is not None:
+                sha = hashlib.sha256(blob).hexdigest()
+                response["blob"] = sha
+                if sha not in self.blobs:
+                    self.blobs[sha] = blob
+                    lines.append({"type": "blob", "sha": sha, "data": base64.b64encode(blob).decode("ascii")})
+            lines.append(record)
+            self.entries[key].append(record)
+            self.recorded += 1
+            # 整个录制过程共用一个写入器（.gz 只产生一个 gzip 成员），每条记录写完立即 flush，
+            # 进程中途退出也不会丢失已录制的内容
+            if self._writer is None:
+                self._writer = _open(self.path, "a")
+            for line in lines:
+                self._writer.write(json.dumps(line, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self._writer.flush()
+        metrics.incr("cassette.record")
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            kinds = defaultdict(int)
+            latency = defaultdict(float)
+            for entries in self.entries.values():
+                for entry in entries:
+                    kinds[entry["type"]] += 1
+                    latency[entry["type"]] += entry["latency"]
+            return {
+                "path": self.path,
+                "mode": self.mode,
+                "entries": dict(kinds),
+                "recorded_latency_s": dict(latency),
+                "blobs": len(self.blobs),
+                "blob_bytes": sum(len(b) for b in self.blobs.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "recorded": self.recorded,
+            }
+
+
+def _chunk(text: Optional[str], finish_reason: Optional[str] = None, usage: Optional[dict] = None):
+    """与 openai 流式响应块结构相同的对象"""
+    choices = [] if text is None else [SimpleNamespace(delta=SimpleNamespace(content=text), finish_reason=finish_reason)]
+    return SimpleNamespace(choices=choices, usage=SimpleNamespace(**usage) if usage else None)
+
+
+def _usage(response: dict) -> Optional[dict]:
+    if response.get("completion_tokens") is None:
+        return None
+    return {"completion_tokens": response["completion_tokens"], "prompt_tokens": response.get("prompt_tokens")}
+
+
+class ReplayStream:
+    """按录制的块和到达时间回放流式输出，接口与 openai 的 Stream 相同（可迭代、可 close）"""
+
+    def __init__(self, cassette: Cassette, response: dict):
+        self.cassette = cassette
+        self.response = response
+        self.closed = False
+
+    def __iter__(self):
+        response = self.response
+        chunks = response.get("chunks")
+        if chunks is None:
+            # 非流式录制作为单块回放
+            chunks = [[response.get("content") or "", response.get("latency", 0.0)]]
+        elapsed = 0.0
+        for text, offset in chunks:
+            if self.closed:
+                return
+            self.cassette.wait(offset - elapsed)
+            elapsed = offset
+            yield _chunk(text)
+        if not response.get("partial"):
+            yield _chunk("", response.get("finish_reason"), _usage(response))
+
+    def close(self):
+        self.closed = True
+
+
+class RecordingStream:
+    """包装真实的流式响应，逐块转发并记录到达时间；结束或被 close() 时写入 cassette"""
+
+    def __init__(self, cassette: Cassette, key: str, request: dict, response, start: float):
+        self.cassette = cassette
+        self.key = key
+        self.request = request
+        self.response = response
+        self.start = start
+        self.chunks = []
+        self.usage = None
+        self.finish_reason = None
+        self._saved = False
+
+    def __iter__(self):
+        for chunk in self.response:
+            if getattr(chunk, "usage", None):
+                self.usage = chunk.usage
+            if chunk.choices:
+                self.finish_reason = chunk.choices[0].finish_reason or self.finish_reason
+                if chunk.choices[0].delta.content:
+                    self.chunks.append([chunk.choices[0].delta.content, round(time.perf_counter() - self.start, 6)])
+            yield chunk
+        self._save(partial=False)
+
+    def close(self):
+        self.response.close()
+        # 提前终止的输出也录制下来，回放时同样在此处结束
+        self._save(partial=True)
+
+    def _save(self, partial: bool):
+        if self._saved:
+            return
+        self._saved = True
+        response = {
+            "content": "".join(text for text, _ in self.chunks),
+            "chunks": self.chunks,
+            "completion_tokens": getattr(self.usage, "completion_tokens", None),
+            "prompt_tokens": getattr(self.usage, "prompt_tokens", None),
+            "finish_reason": self.finish_reason,
+        }
+        if partial:
+            response["partial"] = True
+        self.cassette.record("chat", self.key, self.request, response, time.perf_counter() - self.start)
+
+
+def replay_chat(cassette: Cassette, key: str, stream: bool):
+    """返回与 openai 补全响应结构相同的对象（流式时为 ReplayStream）"""
+    entry = cassette.lookup(key)
+    response = dict(entry["response"], latency=entry["latency"])
+    if stream:
+        return ReplayStream(cassette, response)
+    cassette.wait(entry["latency"])
+    usage = _usage(response) or {"completion_tokens": None, "prompt_tokens": None}
+    return SimpleNamespace(
+        choices=[SimpleNamespace(
+            message=SimpleNamespace(content=response.get("content")),
+            finish_reason=response.get("finish_reason"),
+        )],
+        usage=SimpleNamespace(**usage),
+    )
+
+
+def chat_response(response) -> dict:
+    """从非流式补全响应中取出需要录制的字段"""
+    return {
+        "content": response.choices[0].message.content,
+        "completion_tokens": response.usage.completion_tokens,
+        "prompt_tokens": response.usage.prompt_tokens,
+        "finish_reason": response.choices[0].finish_reason,
+    }
+
+
+_active: Optional[Cassette] = None
+
+
+def use(path: str, mode: str = REPLAY, timing: bool = False) -> Cassette:
+    """启用 cassette（替换当前的）"""
+    global _active
+    stop()
+    _active = Cassette(path, mode, timing)
+    return _active
+
+
+def stop():
+    global _active
+    if _active is not None:
+        _active.close()
+    _active = None
+
+
+def active() -> Optional[Cassette]:
+    return _active
+
+
+def _from_env():
+    path = os.getenv("LLM_CASSETTE")
+    if path:
+        use(path, os.getenv("LLM_CASSETTE_MODE", REPLAY), os.getenv("LLM_CASSETTE_TIMING", "") not in ("", "0"))
+
+
+atexit.register(stop)
+_from_env()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="查看 cassette 文件内容")
+    parser.add_argument("path")
+    args = parser.parse_args(argv)
+    print(json.dumps(Cassette(args.path, REPLAY).stats(), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
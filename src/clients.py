@@ -0,0 +1,223 @@
+import os
+import random
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+T = TypeVar("T")
+
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+# APIRequestFailedError 是 ZhipuAI SDK 的 400 错误（请求非法 / 内容被拒），不重试
+_RETRY_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "APIServerFlowExceedError"}
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    code = getattr(exc, "status_code", None)
+    if code is None:
+        code = getattr(getattr(exc, "response", None), "status_code", None)
+    return code
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """429 / 5xx / 连接错误 / 超时 可以重试"""
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout, httpx.TransportError)):
+        return True
+    if _status_code(exc) in RETRY_STATUS:
+        return True
+    return type(exc).__name__ in _RETRY_ERROR_NAMES
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """指数退避 + 全抖动：在 [0, min(cap, base * 2^attempt)] 中均匀取值"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class ClientPool:
+    """
+    复用的 API 客户端与 HTTP 会话（长连接），并统计连接复用情况
+
+    参数:
+        timeout: 读超时（秒）
+        connect_timeout: 建连超时（秒）
+        max_retries: 最大重试次数
+        backoff_base: 退避基数（秒）
+        backoff_cap: 单次退避上限（秒）
+        pool_size: 每个主机保持的最大连接数
+    """
+
+    def __init__(
+        self,
+        timeout: float = 120.0,
+        connect_timeout: float = 10.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 8.0,
+        pool_size: int = 16,
+    ):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._openai = None
+        self._zhipu = None
+        self._session = None
+        self._httpx = None
+        self._stats = {
+            "clients_created": 0,
+            "http_requests": 0,
+            "connections_opened": 0,
+            "retries": 0,
+        }
+
+    # ---- httpx（OpenAI / ZhipuAI SDK 底层都使用 httpx）----
+
+    def _trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self._stats["connections_opened"] += 1
+
+    def _on_request(self, request: httpx.Request):
+        # 通过 httpcore 的 trace 扩展统计新建的 TCP 连接
+        request.extensions["trace"] = self._trace
+        with self._lock:
+            self._stats["http_requests"] += 1
+
+    def _make_httpx(self) -> httpx.Client:
+        return httpx.Client(
+            timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size,
+                keepalive_expiry=60.0,
+            ),
+            event_hooks={"request": [self._on_request]},
+        )
+
+    def _get(self, attr: str, factory: Callable[[], T]) -> T:
+        """在 self._lock 内创建客户端；factory 不能再调用 _get（锁不可重入），依赖需事先创建好"""
+        client = getattr(self, attr)
+        if client is None:
+            with self._lock:
+                client = getattr(self, attr)
+                if client is None:
+                    client = factory()
+                    setattr(self, attr, client)
+                    self._stats["clients_created"] += 1
+        return client
+
+    def http(self) -> httpx.Client:
+        return self._get("_httpx", self._make_httpx)
+
+    def openai(self):
+        from openai import OpenAI
+        http_client = self.http()
+
+        def factory():
+            return OpenAI(
+                api_key=os.getenv("SILICON_API_KEY"),
+                base_url=os.getenv("SILICON_BASE_URL", "https://api.siliconflow.cn/v1"),
+                http_client=http_client,
+                max_retries=0,  # 由 call_with_retry 统一处理重试
+            )
+        return self._get("_openai", factory)
+
+    def zhipu(self):
+        from zhipuai import ZhipuAI
+        http_client = self.http()
+
+        def factory():
+            return ZhipuAI(
+                api_key=os.getenv("ZHIPUAI_API_KEY", "06d3a1bc08516b363099cd9826143c8d.FjukLsi1czNirl4d"),  # 请填写您自己的APIKey
+                base_url=os.getenv("ZHIPUAI_BASE_URL"),
+                http_client=http_client,
+                max_retries=0,
+            )
+        return self._get("_zhipu", factory)
+
+    # ---- requests 会话（图片下载）----
+
+    def session(self) -> requests.Session:
+        def factory():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            return session
+        return self._get("_session", factory)
+
+    def download(self, url: str) -> bytes:
+        """使用长连接会话下载完整内容，失败时按退避策略重试"""
+        def fetch():
+            response = self.session().get(url, timeout=(self.connect_timeout, self.timeout))
+            response.raise_for_status()
+            return response.content
+        return self.call_with_retry(fetch)
+
+    # ---- 重试 ----
+
+    def call_with_retry(self, fn: Callable[[], T]) -> T:
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                with self._lock:
+                    self._stats["retries"] += 1
+                time.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+                attempt += 1
+
+    # ---- 统计 ----
+
+    def _session_stats(self):
+        requests_made = connections = 0
+        if self._session is not None:
+            for adapter in set(self._session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is not None:
+                        requests_made += pool.num_requests
+                        connections += pool.num_connections
+        return requests_made, connections
+
+    def stats(self) -> dict:
+        """连接复用统计：reused = 请求数 - 新建连接数"""
+        with self._lock:
+            stats = dict(self._stats)
+        session_requests, session_connections = self._session_stats()
+        stats["download_requests"] = session_requests
+        stats["download_connections"] = session_connections
+        total_requests = stats["http_requests"] + session_requests
+        total_connections = stats["connections_opened"] + session_connections
+        stats["reused_connections"] = max(0, total_requests - total_connections)
+        stats["reuse_rate"] = stats["reused_connections"] / total_requests if total_requests else 0.0
+        return stats
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            if self._httpx is not None:
+                self._httpx.close()
+            self._openai = self._zhipu = self._session = self._httpx = None
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+pool = ClientPool(
+    timeout=_env_float("LLM_TIMEOUT", 120.0),
+    connect_timeout=_env_float("LLM_CONNECT_TIMEOUT", 10.0),
+    max_retries=int(_env_float("LLM_MAX_RETRIES", 3)),
+)
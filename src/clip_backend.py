@@ -0,0 +1,214 @@
+"""
+CLIP 在 CPU 上的推理后端，由环境变量 CLIP_BACKEND 选择（见 src/loss.py）：
+
+    eager        原始 fp32 PyTorch（参考实现，默认）
+    int8         对 Linear 层做动态 int8 量化
+    torchscript  trace + freeze 后的 TorchScript 图
+    onnx         导出为 ONNX，用 onnxruntime 推理（需要安装 onnxruntime）
+    onnx-int8    在 onnx 的基础上对权重做动态 int8 量化
+
+CLIP_THREADS 指定推理线程数（torch 的 intra-op 线程 / onnxruntime 的 intra_op_num_threads）。
+不同后端的嵌入与参考实现之间存在少量偏差，可用 benchmarks/clip_parity.py 测量。
+"""
+import os
+from typing import Optional
+
+import numpy as np
+
+BACKENDS = ("eager", "int8", "torchscript", "onnx", "onnx-int8")
+# 导出图使用固定长度的文本输入（CLIP 的最大长度）
+TEXT_LENGTH = 77
+DEFAULT_EXPORT_DIR = os.path.join(".cache", "clip_export")
+
+
+def set_num_threads(threads: Optional[int]):
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+
+
+def _feature_modules(model):
+    """把 get_image_features / get_text_features 包装成可 trace / 导出的模块"""
+    import torch
+
+    class ImageFeatures(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            return self.model.get_image_features(pixel_values=pixel_values)
+
+    class TextFeatures(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+    return ImageFeatures().eval(), TextFeatures().eval()
+
+
+def _example_inputs(model):
+    import torch
+    size = model.config.vision_config.image_size
+    pixel_values = torch.zeros(2, 3, size, size)
+    input_ids = torch.zeros(2, TEXT_LENGTH, dtype=torch.long)
+    attention_mask = torch.ones(2, TEXT_LENGTH, dtype=torch.long)
+    return pixel_values, input_ids, attention_mask
+
+
+class EagerBackend:
+    """
+    参数:
+        model: 已加载的 CLIPModel
+        threads: 推理线程数，None 表示使用默认值
+    """
+    name = "eager"
+    # 文本填充方式："longest" 按批内最长填充；导出图需要固定长度 "max_length"
+    text_padding = "longest"
+
+    def __init__(self, model, threads: Optional[int] = None):
+        set_num_threads(threads)
+        self.model = model
+        self.projection_dim = model.config.projection_dim
+
+    def image_features(self, pixel_values) -> np.ndarray:
+        import torch
+        with torch.no_grad():
+            return self.model.get_image_features(pixel_values=pixel_values).numpy()
+
+    def text_features(self, input_ids, attention_mask) -> np.ndarray:
+        import torch
+        with torch.no_grad():
+            return self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask).numpy()
+
+
+class Int8Backend(EagerBackend):
+    name = "int8"
+
+    def __init__(self, model, threads: Optional[int] = None):
+        import torch
+        super().__init__(model, threads)
+        # 只量化 Linear 权重，激活在运行时动态量化；不修改传入的模型
+        self.model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class TorchScriptBackend(EagerBackend):
+    name = "torchscript"
+    text_padding = "max_length"
+
+    def __init__(self, model, threads: Optional[int] = None):
+        import torch
+        super().__init__(model, threads)
+        image_module, text_module = _feature_modules(model)
+        pixel_values, input_ids, attention_mask = _example_inputs(model)
+        with torch.no_grad():
+            self._image = torch.jit.optimize_for_inference(
+                torch.jit.freeze(torch.jit.trace(image_module, pixel_values, check_trace=False))
+            )
+            self._text = torch.jit.optimize_for_inference(
+                torch.jit.freeze(torch.jit.trace(text_module, (input_ids, attention_mask), check_trace=False))
+            )
+
+    def image_features(self, pixel_values) -> np.ndarray:
+        import torch
+        with torch.no_grad():
+            return self._image(pixel_values).numpy()
+
+    def text_features(self, input_ids, attention_mask) -> np.ndarray:
+        import torch
+        with torch.no_grad():
+            return self._text(input_ids, attention_mask).numpy()
+
+
+class OnnxBackend(EagerBackend):
+    """
+    首次使用时把图像 / 文本两部分分别导出到 export_dir，之后直接加载已导出的文件
+
+    参数:
+        quantize: 对导出的权重做动态 int8 量化（onnxruntime.quantization）
+        export_dir: 导出文件目录，按模型名和是否量化区分
+    """
+    name = "onnx"
+    text_padding = "max_length"
+
+    def __init__(self, model, threads: Optional[int] = None, quantize: bool = False,
+                 export_dir: str = DEFAULT_EXPORT_DIR, model_name: str = "clip"):
+        import onnxruntime as ort
+        super().__init__(model, threads)
+        if quantize:
+            self.name = "onnx-int8"
+        directory = os.path.join(export_dir, model_name.replace("/", "--"))
+        os.makedirs(directory, exist_ok=True)
+        image_path, text_path = self._export(model, directory)
+        if quantize:
+            image_path, text_path = self._quantize(image_path), self._quantize(text_path)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        providers = ["CPUExecutionProvider"]
+        self._image = ort.InferenceSession(image_path, options, providers=providers)
+        self._text = ort.InferenceSession(text_path, options, providers=providers)
+
+    @staticmethod
+    def _export(model, directory: str):
+        import torch
+        image_path = os.path.join(directory, "image.onnx")
+        text_path = os.path.join(directory, "text.onnx")
+        if os.path.exists(image_path) and os.path.exists(text_path):
+            return image_path, text_path
+        image_module, text_module = _feature_modules(model)
+        pixel_values, input_ids, attention_mask = _example_inputs(model)
+        with torch.no_grad():
+            # 先写临时文件再改名，导出中断时不会留下不完整的模型
+            torch.onnx.export(
+                image_module, (pixel_values,), image_path + ".tmp",
+                input_names=["pixel_values"], output_names=["features"],
+                dynamic_axes={"pixel_values": {0: "batch"}, "features": {0: "batch"}},
+                opset_version=17,
+            )
+            torch.onnx.export(
+                text_module, (input_ids, attention_mask), text_path + ".tmp",
+                input_names=["input_ids", "attention_mask"], output_names=["features"],
+                dynamic_axes={"input_ids": {0: "batch"}, "attention_mask": {0: "batch"}, "features": {0: "batch"}},
+                opset_version=17,
+            )
+        os.replace(image_path + ".tmp", image_path)
+        os.replace(text_path + ".tmp", text_path)
+        return image_path, text_path
+
+    @staticmethod
+    def _quantize(path: str) -> str:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        out = path[:-len(".onnx")] + ".int8.onnx"
+        if not os.path.exists(out):
+            quantize_dynamic(path, out + ".tmp", weight_type=QuantType.QInt8)
+            os.replace(out + ".tmp", out)
+        return out
+
+    def image_features(self, pixel_values) -> np.ndarray:
+        return self._image.run(None, {"pixel_values": np.asarray(pixel_values, dtype=np.float32)})[0]
+
+    def text_features(self, input_ids, attention_mask) -> np.ndarray:
+        return self._text.run(None, {
+            "input_ids": np.asarray(input_ids, dtype=np.int64),
+            "attention_mask": np.asarray(attention_mask, dtype=np.int64),
+        })[0]
+
+
+def create_backend(name: str, model, threads: Optional[int] = None, model_name: str = "clip",
+                   export_dir: str = DEFAULT_EXPORT_DIR) -> EagerBackend:
+    """按名称创建后端，名称见 BACKENDS"""
+    if name == "eager":
+        return EagerBackend(model, threads)
+    if name == "int8":
+        return Int8Backend(model, threads)
+    if name == "torchscript":
+        return TorchScriptBackend(model, threads)
+    if name in ("onnx", "onnx-int8"):
+        return OnnxBackend(model, threads, quantize=name == "onnx-int8", export_dir=export_dir, model_name=model_name)
+    raise ValueError(f"unknown CLIP backend {name!r}, expected one of {', '.join(BACKENDS)}")
@@ -0,0 +1,312 @@
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from src.history import HistoryBuffer
+from src.token_budget import BudgetExceededError, TokenBudget, planner
+
+# 阶段：setup -> defense -> attack
+SETUP = "setup"
+DEFENSE = "defense"
+ATTACK = "attack"
+
+
+class GameError(Exception):
+    """输入不合法时抛出，title / message 可直接用于界面提示"""
+
+    def __init__(self, title: str, message: str):
+        super().__init__(message)
+        self.title = title
+        self.message = message
+
+
+class IllegalAttackError(GameError):
+    """攻击提示词包含关键词中的字"""
+
+
+def find_forbidden_char(keyword: str, attack: str) -> Optional[str]:
+    """返回攻击提示词中出现的第一个关键词字符，没有则返回 None"""
+    for char in keyword:
+        if char in attack:
+            return char
+    return None
+
+
+def check_attack(keyword: str, attack: str):
+    if not attack:
+        raise GameError("输入不完整", "请填写攻击提示词")
+    char = find_forbidden_char(keyword, attack)
+    if char is not None:
+        raise IllegalAttackError("非法攻击提示", f"攻击提示不能包含关键词的任意字：'{char}'")
+
+
+class KeywordMatcher:
+    """
+    流式输出的增量关键词匹配：只保留上一块末尾 len(keyword)-1 个字符，
+    因此关键词被拆在两个块之间时也能匹配到
+    """
+
+    def __init__(self, keyword: str):
+        self.keyword = keyword
+        self.found = False
+        self._tail = ""
+
+    def feed(self, chunk: str) -> bool:
+        if self.found or not self.keyword:
+            return self.found
+        window = self._tail + chunk
+        if self.keyword in window:
+            self.found = True
+        elif len(self.keyword) > 1:
+            self._tail = window[-(len(self.keyword) - 1):]
+        return self.found
+
+
+@dataclass
+class AttackResult:
+    attack: str
+    content: Optional[str] = None
+    tokens: Optional[int] = None
+    success: bool = False
+    latency: float = 0.0
+    error: Optional[str] = None
+    cached: bool = False
+    aborted: bool = False
+    prompt_tokens: Optional[int] = None
+    max_tokens: Optional[int] = None
+    truncated: bool = False
+
+    def to_dict(self) -> dict:
+        return {
+            "attack": self.attack,
+            "success": self.success,
+            "tokens": self.tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "max_tokens": self.max_tokens,
+            "truncated": self.truncated,
+            "cached": self.cached,
+            "aborted": self.aborted,
+            "latency": round(self.latency, 4),
+            "content": self.content,
+            "error": self.error,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "AttackResult":
+        return cls(**data)
+
+
+def _consume_stream(stream, keyword: str, on_chunk: Optional[Callable[[str], None]]):
+    """逐块读取流式输出，一旦关键词出现立即关闭流；返回 (内容, ChatResult 或 None, 是否提前终止, 块数)"""
+    matcher = KeywordMatcher(keyword)
+    parts = []
+    while True:
+        try:
+            chunk = next(stream)
+        except StopIteration as stop:
+            return "".join(parts), stop.value, False, len(parts)
+        parts.append(chunk)
+        if on_chunk is not None:
+            on_chunk(chunk)
+        if matcher.feed(chunk):
+            stream.close()
+            return "".join(parts), None, True, len(parts)
+
+
+def _add_usage(result, first):
+    """重试时两次请求的用量都要计入（命中缓存的重试结果不计）"""
+    if first is None or result is None or getattr(result, "cached", False):
+        return result
+    return result._replace(
+        completion_tokens=(result.completion_tokens or 0) + (first.completion_tokens or 0),
+        prompt_tokens=(result.prompt_tokens or 0) + (first.prompt_tokens or 0),
+    )
+
+
+def evaluate_attack(
+    keyword: str,
+    defense: str,
+    attack: str,
+    complete: Optional[Callable] = None,
+    stream: bool = False,
+    on_chunk: Optional[Callable[[str], None]] = None,
+    budget: Optional[TokenBudget] = None,
+) -> AttackResult:
+    """
+    用防守提示词作为 system、攻击提示词作为 user 调用模型，判断关键词是否泄露
+
+    参数:
+        complete: 聊天补全函数，默认使用 get_chat_completion
+        stream: 使用流式输出，关键词一出现就终止生成
+        on_chunk: 流式模式下每收到一块文本时的回调
+        budget: 单局 token 预算，不足时返回带 error 的结果
+
+    max_tokens 由 src/token_budget.py 自适应选取；输出被截断且未出现关键词时，
+    以上限 max_tokens 重试一次，保证判定结果与不限长度时一致（流式重试的输出同样经 on_chunk 送出）
+    """
+    if complete is None:
+        from src.call_llm import get_chat_completion
+        complete = get_chat_completion
+    kwargs = {} if budget is None else {"budget": budget}
+    start = time.perf_counter()
+    try:
+        if stream:
+            first = None
+            response = complete(defense, attack, use_stream=True, **kwargs)
+            content, result, aborted, chunks = _consume_stream(response, keyword, on_chunk)
+            if not aborted and getattr(result, "truncated", False):
+                first = result
+                if on_chunk is not None:
+                    on_chunk("\n（输出达到 max_tokens 上限被截断，以更大的上限重试）\n")
+                response = complete(defense, attack, use_stream=True, max_tokens=planner.ceiling, **kwargs)
+                content, result, aborted, chunks = _consume_stream(response, keyword, on_chunk)
+            latency = time.perf_counter() - start
+            if aborted:
+                # 提前终止时拿不到 ChatResult：命中缓存的不计 token；否则服务端不会返回 usage，
+                # 输出以已收到的块数近似、prompt 以发送前的估算值计（与预算的扣减一致）
+                cached = bool(getattr(response, "cached", False))
+                tokens = prompt_tokens = None
+                if not cached:
+                    tokens = chunks + ((first.completion_tokens or 0) if first else 0)
+                    prompt_tokens = getattr(response, "estimated_prompt_tokens", None)
+                    if first is not None and prompt_tokens is not None:
+                        prompt_tokens += first.prompt_tokens or 0
+                return AttackResult(
+                    attack, content, tokens, True, latency, cached=cached, aborted=True,
+                    prompt_tokens=prompt_tokens, max_tokens=getattr(response, "max_tokens", None),
+                )
+            result = _add_usage(result, first)
+            if result is None:
+                # 流中途出错时保留已收到的输出（其中没有关键词，否则已提前终止）
+                return AttackResult(attack, content or None, latency=latency, error="请求失败")
+        else:
+            result = complete(defense, attack, **kwargs)
+            if getattr(result, "truncated", False) and keyword not in (result.content or ""):
+                first = result
+                retry = complete(defense, attack, max_tokens=planner.ceiling, **kwargs)
+                result = first if retry is None else _add_usage(retry, first)
+            latency = time.perf_counter() - start
+            if result is None:
+                return AttackResult(attack, latency=latency, error="请求失败")
+    except BudgetExceededError as e:
+        return AttackResult(attack, latency=time.perf_counter() - start, error=str(e))
+    cached = False
+    if isinstance(result, tuple):
+        content, tokens = result[0], result[1]
+        cached = bool(getattr(result, "cached", False))
+    elif stream:
+        tokens = None
+    else:
+        content, tokens = result, None
+    content = content or ""
+    return AttackResult(
+        attack, content, tokens, keyword in content, latency, cached=cached,
+        prompt_tokens=getattr(result, "prompt_tokens", None),
+        max_tokens=getattr(result, "max_tokens", None),
+        truncated=getattr(result, "truncated", False),
+    )
+
+
+@dataclass
+class DefenseGame:
+    """提示词攻防游戏的状态与阶段逻辑，与界面无关（Tk 界面和批量评测共用）"""
+    round_time: int = 60
+    defense_time: int = 15 * 60
+    token_budget: Optional[int] = None  # 单局 token 上限（prompt + 输出），None 表示不限
+    history_limit: int = 500  # 内存中保留的最近攻击记录数
+    history_path: Optional[str] = None  # 全部攻击记录的落盘路径，None 表示只保留最近 history_limit 条
+    keyword: str = ""
+    defense: str = ""
+    phase: str = SETUP
+    attack_started: bool = False
+    total_tokens: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    time_left: int = 0
+    timer_running: bool = False
+    attack_history: HistoryBuffer = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.budget = TokenBudget(self.token_budget, "本局")
+        self.attack_history = HistoryBuffer(
+            self.history_limit, self.history_path, AttackResult.to_dict, AttackResult.from_dict,
+        )
+
+    def set_keyword(self, keyword: str):
+        keyword = keyword.strip()
+        if not keyword:
+            raise GameError("输入不完整", "请填写关键词")
+        self.keyword = keyword
+        self.phase = DEFENSE
+        self.time_left = self.defense_time
+        self.timer_running = True
+
+    def submit_defense(self, defense: str):
+        defense = defense.strip()
+        if not defense:
+            raise GameError("提示词缺失", "请填写防守方提示词")
+        self.defense = defense
+        self.timer_running = False
+        self.phase = ATTACK
+
+    def start_attack(self):
+        self.attack_started = True
+        self.time_left = self.round_time
+        self.timer_running = True
+
+    def prepare_attack(self, attack: str) -> str:
+        """校验攻击提示词，返回去除首尾空白后的内容"""
+        attack = attack.strip()
+        check_attack(self.keyword, attack)
+        if self.budget.exhausted():
+            raise GameError("预算不足", f"本局 token 预算（{self.token_budget}）已用完")
+        return attack
+
+    def finish_attack(self, result: AttackResult):
+        """记录结果并重置本轮计时"""
+        self.record(result)
+        self.time_left = self.round_time
+        self.timer_running = False
+
+    def attack(self, attack: str, complete: Optional[Callable] = None, **kwargs) -> AttackResult:
+        """校验并执行一次攻击（同步），kwargs 透传给 evaluate_attack"""
+        attack = self.prepare_attack(attack)
+        kwargs.setdefault("budget", self.budget)
+        result = evaluate_attack(self.keyword, self.defense, attack, complete, **kwargs)
+        self.finish_attack(result)
+        return result
+
+    def record(self, result: AttackResult):
+        # 命中缓存的结果没有实际消耗 token；预算的扣减在请求时已完成
+        if not result.cached:
+            self.prompt_tokens += result.prompt_tokens or 0
+            self.completion_tokens += result.tokens or 0
+            self.total_tokens = self.prompt_tokens + self.completion_tokens
+        self.attack_history.append(result)
+
+    def toggle_timer(self) -> bool:
+        self.timer_running = not self.timer_running
+        return self.timer_running
+
+    def tick(self) -> Optional[str]:
+        """
+        计时器每秒调用一次
+
+        返回:
+            None: 继续计时
+            "defense_timeout": 防守阶段超时，已自动进入攻击阶段
+            "attack_timeout": 本轮攻击时间结束
+        """
+        if self.timer_running and self.time_left > 0:
+            self.time_left -= 1
+            return None
+        if self.time_left == 0:
+            if self.phase == DEFENSE:
+                self.phase = ATTACK
+                self.attack_started = True
+                self.timer_running = True
+                self.time_left = self.round_time
+                return "defense_timeout"
+            if self.phase == ATTACK:
+                return "attack_timeout"
+        return None
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+from PIL import Image
+
+
+def image_key(img: Image.Image, namespace: str = "") -> str:
+    """按图片内容（模式、尺寸、像素）计算哈希键"""
+    h = hashlib.sha1(namespace.encode("utf-8"))
+    h.update(f"img:{img.mode}:{img.size[0]}x{img.size[1]}:".encode("utf-8"))
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+def text_key(text: str, namespace: str = "") -> str:
+    """按文本内容计算哈希键"""
+    h = hashlib.sha1(namespace.encode("utf-8"))
+    h.update(b"txt:")
+    h.update(text.encode("utf-8"))
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    嵌入向量缓存：内存 LRU + 可选的磁盘存储（每个键一个 .npy 文件）
+
+    参数:
+        max_items: 内存中最多保留的条目数
+        disk_dir: 磁盘缓存目录，为 None 时只使用内存
+    """
+
+    def __init__(self, max_items: int = 256, disk_dir: Optional[str] = None):
+        self.max_items = max_items
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.npy")
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+        if self.disk_dir and os.path.exists(self._disk_path(key)):
+            try:
+                value = np.load(self._disk_path(key))
+            except (OSError, ValueError):
+                value = None
+            if value is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                self._remember(key, value)
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _remember(self, key: str, value: np.ndarray):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def put(self, key: str, value: np.ndarray):
+        self._remember(key, value)
+        if self.disk_dir:
+            # 先写临时文件再替换，避免并发读到半截文件
+            tmp = self._disk_path(key) + ".tmp.npy"
+            np.save(tmp, value)
+            os.replace(tmp, self._disk_path(key))
+
+    def get_or_compute(self, key: str, compute: Callable[[], np.ndarray]) -> np.ndarray:
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = self.disk_hits = self.misses = 0
+
+    def stats(self) -> dict:
+        """返回命中 / 未命中计数"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "size": len(self._items),
+                "hit_rate": self.hits / total if total else 0.0,
+            }
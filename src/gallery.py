@@ -0,0 +1,183 @@
+"""
+多目标图库：预加载一个目录下的全部目标图，把它们的 CLIP 嵌入保存为一个归一化矩阵，
+每张生成图 / 每个提示词与所有目标的相似度只需一次矩阵乘法。
+
+    python -m src.gallery --dir targets/ --image best_image_1.png --prompt "一只猫" --top 5
+
+图库矩阵缓存在 <dir>/.gallery.npz 中，按文件名、大小和修改时间判断是否需要重新编码，
+重新加载未变化的图库时无需解码任何图片。目标图直接前向编码，不经过 loss.embedding_cache，
+以免大量目标挤掉对局中反复使用的嵌入（也不会写入 CLIP_CACHE_DIR）。
+"""
+import argparse
+import os
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from src import image_io, loss, metrics
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+CACHE_NAME = ".gallery.npz"
+
+
+@dataclass
+class GalleryMatch:
+    name: str
+    similarity: float  # 与 calculate_loss_with_image / calculate_loss_with_string 的返回值相同
+
+
+def _normalize_rows(x: np.ndarray) -> np.ndarray:
+    return (x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12)).astype(np.float32)
+
+
+def _file_signature(path: str) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class TargetGallery:
+    """
+    参数:
+        directory: 目标图片目录
+        batch_size: 编码新图片时每次前向的数量
+        use_cache: 是否读写 <directory>/.gallery.npz
+    """
+
+    def __init__(self, directory: str, batch_size: int = 32, use_cache: bool = True):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.use_cache = use_cache
+        self.names: List[str] = []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.load_seconds = 0.0
+        self.encoded = 0  # 本次加载中实际编码的图片数
+        self.load()
+
+    @property
+    def cache_path(self) -> str:
+        return os.path.join(self.directory, CACHE_NAME)
+
+    def _read_cache(self) -> dict:
+        if not (self.use_cache and os.path.exists(self.cache_path)):
+            return {}
+        try:
+            data = np.load(self.cache_path, allow_pickle=False)
+            if str(data["model"]) != loss.embedding_namespace():
+                return {}
+            return {
+                name: (sig, row)
+                for name, sig, row in zip(data["names"].tolist(), data["signatures"].tolist(), data["matrix"])
+            }
+        except (OSError, KeyError, ValueError):
+            return {}
+
+    def load(self):
+        """扫描目录：未变化的图片直接使用缓存的嵌入，只编码新增或修改过的图片"""
+        start = time.perf_counter()
+        names = sorted(
+            name for name in os.listdir(self.directory)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        signatures = [_file_signature(os.path.join(self.directory, name)) for name in names]
+        cached = self._read_cache()
+        rows = [None] * len(names)
+        missing = []
+        for i, (name, sig) in enumerate(zip(names, signatures)):
+            hit = cached.get(name)
+            if hit is not None and hit[0] == sig:
+                rows[i] = hit[1]
+            else:
+                missing.append(i)
+        for offset in range(0, len(missing), self.batch_size):
+            chunk = missing[offset:offset + self.batch_size]
+            # 图片只在编码时解码，编码后立即释放；与游戏加载目标图的方式相同，
+            # 保证嵌入与 calculate_loss_with_image 一致（只限制长边会让宽图的短边低于 CLIP 的 224 px）
+            images = [image_io.load_image(os.path.join(self.directory, names[i])) for i in chunk]
+            for i, emb in zip(chunk, loss._compute_image_features(images)):
+                rows[i] = emb
+        self.encoded = len(missing)
+        self.names = names
+        if rows:
+            self.matrix = _normalize_rows(np.stack(rows))
+        else:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+        if self.use_cache and (missing or len(cached) != len(names)):
+            self._write_cache(signatures)
+        self.load_seconds = time.perf_counter() - start
+        metrics.observe("gallery.load", self.load_seconds)
+
+    def _write_cache(self, signatures: Sequence[str]):
+        tmp = self.cache_path + ".tmp.npz"
+        np.savez(
+            tmp,
+            model=np.array(loss.embedding_namespace()),
+            names=np.array(self.names),
+            signatures=np.array(signatures),
+            matrix=self.matrix,
+        )
+        os.replace(tmp, self.cache_path)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    # ---- 查询 ----
+
+    def similarities(self, texts: Sequence[str] = (), images: Sequence = ()) -> np.ndarray:
+        """
+        返回形状为 (len(texts) + len(images), len(gallery)) 的相似度矩阵，
+        前 len(texts) 行对应 texts，其余行对应 images
+        """
+        with metrics.timer("gallery.query"):
+            queries = np.concatenate([loss.embed_texts(texts), loss.embed_images(images)])
+            return _normalize_rows(queries) @ self.matrix.T
+
+    def _rank(self, sims: np.ndarray, top: Optional[int]) -> List[GalleryMatch]:
+        n = sims.shape[0]
+        if top is None or top >= n:
+            order = np.argsort(-sims)
+        else:
+            # 只对前 top 个排序，图库很大时避免全量排序
+            order = np.argpartition(-sims, top - 1)[:top]
+            order = order[np.argsort(-sims[order])]
+        return [GalleryMatch(self.names[i], float(sims[i])) for i in order]
+
+    def rank_image(self, image, top: Optional[int] = 10) -> List[GalleryMatch]:
+        """生成图片与所有目标的相似度，按相似度从高到低排序"""
+        if not self.names:
+            return []
+        return self._rank(self.similarities(images=[image])[0], top)
+
+    def rank_prompt(self, prompt: str, top: Optional[int] = 10) -> List[GalleryMatch]:
+        """提示词与所有目标的相似度，按相似度从高到低排序"""
+        if not self.names:
+            return []
+        return self._rank(self.similarities(texts=[prompt])[0], top)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="用一个目录中的全部目标图给生成图片 / 提示词打分")
+    parser.add_argument("--dir", required=True, help="目标图片目录")
+    parser.add_argument("--image", help="生成图片路径")
+    parser.add_argument("--prompt", help="提示词")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    gallery = TargetGallery(args.dir)
+    print(f"已加载 {len(gallery)} 张目标图（新编码 {gallery.encoded} 张），耗时 {gallery.load_seconds:.2f}s")
+    queries = []
+    if args.image:
+        queries.append(("图片", lambda: gallery.rank_image(image_io.load_image(args.image), args.top)))
+    if args.prompt:
+        queries.append(("提示词", lambda: gallery.rank_prompt(args.prompt, args.top)))
+    for label, run in queries:
+        start = time.perf_counter()
+        matches = run()
+        print(f"{label}查询耗时 {(time.perf_counter() - start) * 1000:.1f}ms")
+        for rank, match in enumerate(matches, 1):
+            print(f"  {rank:>3}. {match.name:<40} {match.similarity:.4f}")
+
+
+if __name__ == "__main__":
+    main()
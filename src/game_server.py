@@ -0,0 +1,341 @@
+"""
+多人提示词攻防服务：一个进程内运行多个对局，所有对局共享同一个聊天补全调度器。
+
+    python -m src.game_server --port 8080 --max-concurrency 8
+
+HTTP 接口（JSON）：
+    POST   /sessions                         创建对局，返回 session_id
+    GET    /sessions/{id}                    对局状态
+    DELETE /sessions/{id}                    结束对局
+    POST   /sessions/{id}/keyword            {"keyword": ...}
+    POST   /sessions/{id}/defense            {"defense": ...}
+    POST   /sessions/{id}/start_attack
+    POST   /sessions/{id}/attack             {"attack": ...}
+    POST   /sessions/{id}/timer              暂停 / 恢复计时
+    GET    /sessions/{id}/ws                 WebSocket：发送 {"action": "keyword" | "defense" | ..., ...}，
+                                             接收状态、计时和攻击结果推送
+    GET    /stats                            调度器统计（排队延迟等）和 token 用量报告
+"""
+import argparse
+import asyncio
+import itertools
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from functools import partial
+from typing import Callable, Dict, Optional
+
+from aiohttp import WSMsgType, web
+
+from src.defense_game import ATTACK, DEFENSE, SETUP, DefenseGame, GameError, evaluate_attack
+from src.token_budget import planner
+
+
+class LLMScheduler:
+    """
+    共享的补全请求调度器：全局并发上限 + 按对局轮转（round-robin）出队，
+    某个对局一次提交很多请求也不会让其他对局饿死。
+
+    参数:
+        max_concurrency: 同时进行的请求数上限
+    """
+
+    def __init__(self, max_concurrency: int = 8):
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_concurrency, thread_name_prefix="llm")
+        self._queues: Dict[str, deque] = {}
+        self._ready = deque()  # 有待处理请求的对局，按轮转顺序
+        self._running = 0
+        self.completed = 0
+        self.queue_delays = deque(maxlen=2000)
+        self.service_times = deque(maxlen=2000)
+
+    async def submit(self, session_id: str, fn: Callable, *args):
+        """排队执行阻塞函数 fn(*args)，返回其结果"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queue = self._queues.get(session_id)
+        if queue is None:
+            queue = self._queues[session_id] = deque()
+            self._ready.append(session_id)
+        queue.append((future, fn, args, time.perf_counter()))
+        self._dispatch(loop)
+        return await future
+
+    def _dispatch(self, loop: asyncio.AbstractEventLoop):
+        while self._running < self.max_concurrency and self._ready:
+            session_id = self._ready.popleft()
+            queue = self._queues[session_id]
+            future, fn, args, queued_at = queue.popleft()
+            if queue:
+                self._ready.append(session_id)
+            else:
+                del self._queues[session_id]
+            if future.cancelled():
+                continue
+            self._running += 1
+            started = time.perf_counter()
+            self.queue_delays.append(started - queued_at)
+            task = loop.run_in_executor(self._executor, fn, *args)
+            task.add_done_callback(partial(self._finish, loop, future, started))
+
+    def _finish(self, loop, future: asyncio.Future, started: float, task: asyncio.Future):
+        self._running -= 1
+        self.completed += 1
+        self.service_times.append(time.perf_counter() - started)
+        if not future.cancelled():
+            if task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+        self._dispatch(loop)
+
+    def stats(self) -> dict:
+        def pct(values, q):
+            if not values:
+                return 0.0
+            ordered = sorted(values)
+            return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))] * 1000
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self._running,
+            "pending": sum(len(q) for q in self._queues.values()),
+            "pending_sessions": len(self._queues),
+            "completed": self.completed,
+            "queue_delay_p50_ms": pct(self.queue_delays, 50),
+            "queue_delay_p95_ms": pct(self.queue_delays, 95),
+            "queue_delay_max_ms": max(self.queue_delays, default=0.0) * 1000,
+            "service_p50_ms": pct(self.service_times, 50),
+            "service_p95_ms": pct(self.service_times, 95),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class GameSession:
+    """一个对局：DefenseGame 状态 + 订阅的 WebSocket + 每秒一次的计时任务"""
+
+    def __init__(self, session_id: str, scheduler: LLMScheduler, round_time: int, defense_time: int,
+                 token_budget: Optional[int] = None):
+        self.session_id = session_id
+        self.scheduler = scheduler
+        self.game = DefenseGame(round_time=round_time, defense_time=defense_time, token_budget=token_budget)
+        self.sockets = set()
+        self.attack_in_flight = False
+        self.last_active = time.monotonic()
+        self._timer_task = asyncio.get_running_loop().create_task(self._run_timer())
+
+    def state(self) -> dict:
+        game = self.game
+        return {
+            "session_id": self.session_id,
+            "phase": game.phase,
+            "attack_started": game.attack_started,
+            "keyword_set": bool(game.keyword),
+            "time_left": game.time_left,
+            "timer_running": game.timer_running,
+            "total_tokens": game.total_tokens,
+            "prompt_tokens": game.prompt_tokens,
+            "completion_tokens": game.completion_tokens,
+            "budget_remaining": game.budget.remaining(),
+            "attacks": len(game.attack_history),
+            "attack_in_flight": self.attack_in_flight,
+        }
+
+    async def broadcast(self, message: dict):
+        for ws in list(self.sockets):
+            try:
+                await ws.send_json(message)
+            except (ConnectionResetError, RuntimeError):
+                self.sockets.discard(ws)
+
+    async def _run_timer(self):
+        while True:
+            await asyncio.sleep(1)
+            game = self.game
+            if not game.timer_running:
+                continue
+            event = game.tick()
+            if event == "attack_timeout":
+                game.timer_running = False
+            if self.sockets:
+                await self.broadcast({"type": "timer", "event": event, "state": self.state()})
+
+    async def handle(self, action: str, payload: dict) -> dict:
+        """执行一个动作，返回响应；输入错误抛出 GameError"""
+        self.last_active = time.monotonic()
+        game = self.game
+        expected = {"keyword": SETUP, "defense": DEFENSE, "start_attack": ATTACK}.get(action)
+        if expected is not None and game.phase != expected:
+            raise GameError("阶段错误", f"当前阶段为 {game.phase}，不能执行 {action}")
+        if action == "keyword":
+            game.set_keyword(payload.get("keyword", ""))
+        elif action == "defense":
+            game.submit_defense(payload.get("defense", ""))
+        elif action == "start_attack":
+            game.start_attack()
+        elif action == "timer":
+            game.toggle_timer()
+        elif action == "attack":
+            return await self._attack(payload.get("attack", ""))
+        elif action != "state":
+            raise GameError("未知操作", f"未知操作: {action}")
+        await self.broadcast({"type": "state", "state": self.state()})
+        return {"state": self.state()}
+
+    async def _attack(self, attack: str) -> dict:
+        game = self.game
+        if not (game.phase == ATTACK and game.attack_started):
+            raise GameError("阶段错误", "当前不在攻击阶段")
+        if self.attack_in_flight:
+            raise GameError("请稍候", "上一次攻击尚未完成")
+        attack = game.prepare_attack(attack)
+        self.attack_in_flight = True
+        queued_at = time.perf_counter()
+        try:
+            result = await self.scheduler.submit(
+                self.session_id, partial(evaluate_attack, budget=game.budget), game.keyword, game.defense, attack,
+            )
+        finally:
+            self.attack_in_flight = False
+        game.finish_attack(result)
+        response = {
+            "type": "attack_result",
+            "result": asdict(result),
+            "total_seconds": time.perf_counter() - queued_at,
+            "state": self.state(),
+        }
+        await self.broadcast(response)
+        return response
+
+    async def close(self):
+        self._timer_task.cancel()
+        self.game.attack_history.close()
+        for ws in list(self.sockets):
+            await ws.close()
+
+
+class GameServer:
+    def __init__(self, max_concurrency: int = 8, round_time: int = 60, defense_time: int = 15 * 60,
+                 idle_timeout: float = 3600.0, token_budget: Optional[int] = None):
+        self.scheduler = LLMScheduler(max_concurrency)
+        self.token_budget = token_budget
+        self.sessions: Dict[str, GameSession] = {}
+        self.round_time = round_time
+        self.defense_time = defense_time
+        self.idle_timeout = idle_timeout
+        self._ids = itertools.count(1)
+        self._reaper: Optional[asyncio.Task] = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.post("/sessions", self.create_session),
+            web.get("/sessions/{id}", self.get_session),
+            web.delete("/sessions/{id}", self.delete_session),
+            web.post("/sessions/{id}/{action}", self.session_action),
+            web.get("/sessions/{id}/ws", self.session_ws),
+            web.get("/stats", self.stats),
+        ])
+        app.on_startup.append(self._start)
+        app.on_cleanup.append(self._cleanup)
+        return app
+
+    async def _start(self, app):
+        self._reaper = asyncio.get_running_loop().create_task(self._reap_idle())
+
+    async def _cleanup(self, app):
+        if self._reaper:
+            self._reaper.cancel()
+        for session in list(self.sessions.values()):
+            await session.close()
+        self.scheduler.shutdown()
+
+    async def _reap_idle(self):
+        """定期清理长时间无操作且没有连接的对局"""
+        while True:
+            await asyncio.sleep(60)
+            now = time.monotonic()
+            for session_id, session in list(self.sessions.items()):
+                if not session.sockets and now - session.last_active > self.idle_timeout:
+                    await session.close()
+                    self.sessions.pop(session_id, None)
+
+    def _session(self, request: web.Request) -> GameSession:
+        session = self.sessions.get(request.match_info["id"])
+        if session is None:
+            raise web.HTTPNotFound(text='{"error": "session not found"}', content_type="application/json")
+        return session
+
+    async def create_session(self, request: web.Request) -> web.Response:
+        session_id = f"{next(self._ids)}-{uuid.uuid4().hex[:8]}"
+        session = GameSession(session_id, self.scheduler, self.round_time, self.defense_time, self.token_budget)
+        self.sessions[session_id] = session
+        return web.json_response(session.state(), status=201)
+
+    async def get_session(self, request: web.Request) -> web.Response:
+        return web.json_response(self._session(request).state())
+
+    async def delete_session(self, request: web.Request) -> web.Response:
+        session = self._session(request)
+        self.sessions.pop(session.session_id, None)
+        await session.close()
+        return web.json_response({"deleted": session.session_id})
+
+    async def session_action(self, request: web.Request) -> web.Response:
+        session = self._session(request)
+        payload = await request.json() if request.can_read_body else {}
+        try:
+            return web.json_response(await session.handle(request.match_info["action"], payload))
+        except GameError as e:
+            return web.json_response({"error": e.message, "title": e.title}, status=400)
+
+    async def session_ws(self, request: web.Request) -> web.WebSocketResponse:
+        session = self._session(request)
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        session.sockets.add(ws)
+        await ws.send_json({"type": "state", "state": session.state()})
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                try:
+                    data = msg.json()
+                    # 攻击可能要排队，放到独立任务里执行，不阻塞这个连接上的其他消息
+                    asyncio.get_running_loop().create_task(self._ws_action(ws, session, data))
+                except ValueError:
+                    await ws.send_json({"type": "error", "error": "invalid json"})
+        finally:
+            session.sockets.discard(ws)
+        return ws
+
+    async def _ws_action(self, ws, session: GameSession, data: dict):
+        try:
+            await session.handle(data.get("action", ""), data)
+        except GameError as e:
+            if not ws.closed:
+                await ws.send_json({"type": "error", "error": e.message, "title": e.title})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.scheduler.stats(), sessions=len(self.sessions), tokens=planner.report()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多人提示词攻防服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-concurrency", type=int, default=8, help="全局同时进行的补全请求数")
+    parser.add_argument("--round-time", type=int, default=60)
+    parser.add_argument("--defense-time", type=int, default=15 * 60)
+    parser.add_argument("--game-budget", type=int, help="每局 token 上限（prompt + 输出）")
+    args = parser.parse_args(argv)
+    server = GameServer(args.max_concurrency, args.round_time, args.defense_time, token_budget=args.game_budget)
+    web.run_app(server.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+长时间对局的历史记录：内存中只保留最近 capacity 条，全部记录同时追加写入磁盘，
+较早的记录按需从磁盘读取，内存占用不随对局轮数增长。
+
+    <spill_path>        每条记录一行 JSON
+    <spill_path>.idx    每条记录在数据文件中的偏移（8 字节小端整数），按序号直接定位
+"""
+import json
+import os
+import struct
+import threading
+from collections import deque
+from typing import Any, Callable, List, Optional
+
+_OFFSET = struct.Struct("<q")
+
+
+class HistoryBuffer:
+    """
+    参数:
+        capacity: 内存中保留的最近记录数
+        spill_path: 溢出文件路径，None 表示不落盘（超出 capacity 的记录直接丢弃）
+        encode / decode: 记录与可 JSON 序列化的 dict 之间的转换
+    """
+
+    def __init__(
+        self,
+        capacity: int = 500,
+        spill_path: Optional[str] = None,
+        encode: Callable[[Any], dict] = lambda item: item,
+        decode: Callable[[dict], Any] = lambda data: data,
+    ):
+        self.capacity = capacity
+        self.spill_path = spill_path
+        self.encode = encode
+        self.decode = decode
+        self._recent = deque(maxlen=capacity)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._data = self._index = None
+        if spill_path:
+            if os.path.dirname(spill_path):
+                os.makedirs(os.path.dirname(spill_path), exist_ok=True)
+            # 新对局从空文件开始
+            self._data = open(spill_path, "w+b")
+            self._index = open(spill_path + ".idx", "w+b")
+
+    def append(self, item):
+        with self._lock:
+            if self._data is not None:
+                self._data.seek(0, os.SEEK_END)
+                self._index.seek(0, os.SEEK_END)
+                self._index.write(_OFFSET.pack(self._data.tell()))
+                line = json.dumps(self.encode(item), ensure_ascii=False) + "\n"
+                self._data.write(line.encode("utf-8"))
+            self._recent.append(item)
+            self._count += 1
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def first_available(self) -> int:
+        """能读到的最早序号（不落盘时更早的记录已丢弃）"""
+        if self._data is not None:
+            return 0
+        return self._count - len(self._recent)
+
+    def _read(self, i: int):
+        self._index.seek(i * _OFFSET.size)
+        (offset,) = _OFFSET.unpack(self._index.read(_OFFSET.size))
+        self._data.flush()
+        self._data.seek(offset)
+        return self.decode(json.loads(self._data.readline()))
+
+    def __getitem__(self, i: int):
+        with self._lock:
+            if i < 0:
+                i += self._count
+            if not 0 <= i < self._count:
+                raise IndexError(i)
+            tail_start = self._count - len(self._recent)
+            if i >= tail_start:
+                return self._recent[i - tail_start]
+            if self._data is None:
+                raise IndexError(f"history entry {i} was dropped (no spill file)")
+            return self._read(i)
+
+    def page(self, start: int, count: int) -> List:
+        """序号 [start, start + count) 的记录"""
+        start = max(start, self.first_available)
+        stop = min(start + count, self._count)
+        return [self[i] for i in range(start, stop)]
+
+    def recent(self, n: Optional[int] = None) -> List:
+        with self._lock:
+            items = list(self._recent)
+        return items if n is None else items[-n:]
+
+    def __iter__(self):
+        for i in range(self.first_available, self._count):
+            yield self[i]
+
+    def close(self):
+        with self._lock:
+            for f in (self._data, self._index):
+                if f is not None:
+                    f.close()
+            self._data = self._index = None
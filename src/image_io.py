@@ -0,0 +1,82 @@
+import io
+import threading
+import weakref
+from typing import Any, Callable, Optional
+
+from PIL import Image
+
+# 目标图只用于显示（400 px）和 CLIP（224 px），无需保留原始分辨率
+DEFAULT_MAX_SIDE = 1024
+DISPLAY_SIZE = 400
+
+_derived = {}
+_derived_lock = threading.Lock()
+
+
+def _reduce(img: Image.Image, max_side: Optional[int]) -> Image.Image:
+    """按整数倍缩小到不小于 max_side；JPEG 已在解码阶段通过 draft 缩小"""
+    if max_side is None:
+        img.load()
+        return img
+    if img.format == "JPEG":
+        # draft 让解码器直接输出 1/2、1/4、1/8 尺寸，省去完整解码
+        img.draft("RGB", (max_side, max_side))
+    img.load()
+    factor = max(1, max(img.size) // max_side)
+    if factor > 1:
+        img = img.reduce(factor)
+    return img
+
+
+def load_image(path: str, max_side: Optional[int] = DEFAULT_MAX_SIDE) -> Image.Image:
+    """从文件加载并完成解码，max_side=None 时保留原始分辨率"""
+    with open(path, "rb") as f:
+        return decode_bytes(f.read(), max_side)
+
+
+def decode_bytes(data: bytes, max_side: Optional[int] = None) -> Image.Image:
+    """从完整缓冲的字节解码图片（不从未缓冲的网络流中直接解码）"""
+    return _reduce(Image.open(io.BytesIO(data)), max_side)
+
+
+def derived(img: Image.Image, name: str, compute: Callable[[], Any]) -> Any:
+    """
+    为每个图片对象缓存派生数据（缩略图、CLIP 张量、内容哈希等），图片对象被回收时自动清除。
+    图片加载后应视为不可变。
+    """
+    key = id(img)
+    with _derived_lock:
+        entry = _derived.get(key)
+        if entry is not None and name in entry:
+            return entry[name]
+    value = compute()
+    with _derived_lock:
+        entry = _derived.get(key)
+        if entry is None:
+            entry = _derived[key] = {}
+            weakref.finalize(img, _forget, key)
+        entry[name] = value
+    return value
+
+
+def _forget(key: int):
+    with _derived_lock:
+        _derived.pop(key, None)
+
+
+def display_thumbnail(img: Image.Image, max_size: int = DISPLAY_SIZE) -> Image.Image:
+    """居中放在白底正方形上的缩略图，每张图片只计算一次"""
+    def compute():
+        width, height = img.size
+        if width > height:
+            new_width = max_size
+            new_height = int(height * (max_size / width))
+        else:
+            new_height = max_size
+            new_width = int(width * (max_size / height))
+        # reducing_gap 先做快速整数倍缩小，再做 LANCZOS
+        resized = img.convert("RGB").resize((new_width, new_height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        display_img = Image.new("RGB", (max_size, max_size), color="white")
+        display_img.paste(resized, ((max_size - new_width) // 2, (max_size - new_height) // 2))
+        return display_img
+    return derived(img, f"thumbnail:{max_size}", compute)
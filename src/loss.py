@@ -1,21 +1,164 @@
-import torch
-from transformers import CLIPProcessor, CLIPModel
-from scipy.spatial.distance import cosine
+import math
+import os
+import threading
+import time
+import numpy as np
+from src import clip_backend, image_io, metrics
+from src.embedding_cache import EmbeddingCache, image_key, text_key
 
-# Load pre-trained CLIP model and processor
-processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
+MODEL_NAME = "openai/clip-vit-base-patch32"
+# 推理后端与线程数，见 src/clip_backend.py
+BACKEND = os.getenv("CLIP_BACKEND", "eager")
+THREADS = int(os.getenv("CLIP_THREADS") or 0) or None
 
+# CLIP 模型在首次使用时才加载（torch / transformers 的导入也一并推迟），
+# 导入本模块不再阻塞界面启动
+_processor = None
+_model = None
+_backend = None
+_load_lock = threading.Lock()  # 加载期间一直持有
+_warmup_lock = threading.Lock()  # 只保护预热线程的创建，界面线程不会被加载阻塞
+_warmup_thread = None
+model_load_seconds = None
+
+def get_model():
+    """返回 (processor, model)，首次调用时加载（同时创建推理后端）"""
+    global _processor, _model, _backend, model_load_seconds
+    if _model is None:
+        with _load_lock:
+            if _model is None:
+                start = time.perf_counter()
+                from transformers import CLIPProcessor, CLIPModel
+                processor = CLIPProcessor.from_pretrained(MODEL_NAME)
+                model = CLIPModel.from_pretrained(MODEL_NAME)
+                model.eval()
+                with metrics.timer("clip.backend_init"):
+                    _backend = clip_backend.create_backend(BACKEND, model, THREADS, MODEL_NAME)
+                _processor = processor
+                _model = model
+                model_load_seconds = time.perf_counter() - start
+                metrics.observe("clip.load", model_load_seconds)
+    return _processor, _model
+
+def get_backend():
+    get_model()
+    return _backend
+
+def embedding_namespace():
+    """嵌入缓存的命名空间：不同后端的嵌入略有差异，不能混用"""
+    return MODEL_NAME if BACKEND == "eager" else f"{MODEL_NAME}#{BACKEND}"
+
+def is_model_loaded():
+    return _model is not None
+
+def warm_up(background=True):
+    """
+    预先加载模型
+
+    参数:
+        background: 为 True 时在后台线程中加载并立即返回该线程
+    """
+    global _warmup_thread
+    if not background:
+        get_model()
+        return None
+    with _warmup_lock:
+        if _model is None and (_warmup_thread is None or not _warmup_thread.is_alive()):
+            _warmup_thread = threading.Thread(target=get_model, name="clip-warmup", daemon=True)
+            _warmup_thread.start()
+        return _warmup_thread
+
+# CLIP 预处理前先把短边缩小到该尺寸（CLIP 输入为 224）
+CLIP_PRESCALE_SIDE = 448
+
+# 目标图在每轮都会被重复编码，按内容哈希缓存；设置 CLIP_CACHE_DIR 可跨进程持久化
+embedding_cache = EmbeddingCache(disk_dir=os.getenv("CLIP_CACHE_DIR"))
+
+def clip_pixel_values(img):
+    """CLIP 预处理后的像素张量 (1, 3, 224, 224)，每张图片只计算一次"""
+    def compute():
+        processor, _ = get_model()
+        with metrics.timer("clip.preprocess"):
+            # 先用 reducing_gap 快速缩小到短边约 448，避免处理器从原始分辨率重采样；
+            # 按短边计算，宽高比很大的图片短边也不会低于 224（否则处理器会先放大再裁剪）
+            small = img.convert("RGB")  # convert 总是返回副本，thumbnail 不会修改原图
+            scale = CLIP_PRESCALE_SIDE / min(small.size)
+            if scale < 1:
+                small.thumbnail(
+                    (math.ceil(small.width * scale), math.ceil(small.height * scale)), reducing_gap=2.0,
+                )
+            return processor(images=small, return_tensors="pt")["pixel_values"]
+    return image_io.derived(img, "clip_pixels:" + MODEL_NAME, compute)
+def _image_cache_key(img):
+    def compute():
+        with metrics.timer("clip.hash"):
+            return image_key(img, embedding_namespace())
+    return image_io.derived(img, "clip_key:" + embedding_namespace(), compute)
+def _compute_image_features(images):
+    import torch
+    backend = get_backend()
+    pixel_values = torch.cat([clip_pixel_values(img) for img in images])
+    with metrics.timer("clip.image_forward"):
+        return backend.image_features(pixel_values)
+def _compute_text_features(texts):
+    processor, _ = get_model()
+    backend = get_backend()
+    with metrics.timer("clip.tokenize"):
+        inputs = processor(
+            text=list(texts), return_tensors="pt", truncation=True,
+            padding=backend.text_padding, max_length=clip_backend.TEXT_LENGTH,
+        )
+    with metrics.timer("clip.text_forward"):
+        return backend.text_features(inputs["input_ids"], inputs["attention_mask"])
+def _embed_many(items, key_fn, compute_fn, batch_size):
+    """先查缓存，未命中的条目按 batch_size 分批前向，结果写回缓存"""
+    keys = [key_fn(item) for item in items]
+    out = [embedding_cache.get(k) for k in keys]
+    missing = [i for i, v in enumerate(out) if v is None]
+    metrics.incr("clip.cache_hit", len(items) - len(missing))
+    metrics.incr("clip.cache_miss", len(missing))
+    for start in range(0, len(missing), batch_size):
+        chunk = missing[start:start + batch_size]
+        features = compute_fn([items[i] for i in chunk])
+        for i, feat in zip(chunk, features):
+            embedding_cache.put(keys[i], feat)
+            out[i] = feat
+    return np.stack(out) if out else np.zeros((0, get_model()[1].config.projection_dim), dtype=np.float32)
+def embed_images(images, batch_size=16):
+    return _embed_many(list(images), _image_cache_key, _compute_image_features, batch_size)
+def embed_texts(texts, batch_size=64):
+    return _embed_many(list(texts), lambda t: text_key(t, embedding_namespace()), _compute_text_features, batch_size)
 def get_clip_embedding(img):
-    inputs = processor(images=img, return_tensors="pt")
-    with torch.no_grad():
-        features = model.get_image_features(**inputs)
-    return features.squeeze().numpy()
+    return embed_images([img])[0]
 def get_string_embedding(text):
-    inputs = processor(text=text, return_tensors="pt", padding=True, truncation=True)
-    with torch.no_grad():
-        features = model.get_text_features(**inputs)
-    return features.squeeze().numpy()
+    return embed_texts([text])[0]
+def _normalize(x):
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12)
+def score_batch(texts=(), images=(), targets=(), batch_size=32):
+    """
+    批量计算提示词 / 图片与目标图之间的 CLIP 余弦相似度
+
+    参数:
+        texts: 提示词列表
+        images: 候选图片列表
+        targets: 目标图片列表
+        batch_size: 每次前向的最大条目数
+
+    返回:
+        形状为 (len(texts) + len(images), len(targets)) 的相似度矩阵，
+        前 len(texts) 行对应 texts，其余行对应 images
+    """
+    queries = np.concatenate([
+        embed_texts(texts, batch_size),
+        embed_images(images, batch_size),
+    ])
+    target_emb = embed_images(targets, batch_size)
+    return _normalize(queries) @ _normalize(target_emb).T
+def get_cache_stats():
+    return embedding_cache.stats()
+def cosine(u, v):
+    """余弦距离（与 scipy.spatial.distance.cosine 一致）"""
+    return 1.0 - float(np.dot(u, v) / max(np.linalg.norm(u) * np.linalg.norm(v), 1e-12))
 def calculate_loss_with_image(img1, img2):
     embedding1 = get_clip_embedding(img1)
     embedding2 = get_clip_embedding(img2)
@@ -26,4 +169,3 @@ def calculate_loss_with_string(text, img):
     embedding2 = get_clip_embedding(img)
     loss = 1 - cosine(embedding1, embedding2)
     return loss
-
@@ -0,0 +1,236 @@
+"""
+轻量级的分阶段计时与计数：
+
+    from src import metrics
+    with metrics.timer("chat.request"):
+        ...
+    metrics.incr("chat.cache_hit")
+
+    with metrics.tag(job_id):      # 本线程内的事件都带上 job，可按 job 汇总
+        ...
+
+默认关闭，关闭时 timer() / tag() 返回一个共享的空上下文管理器，几乎没有开销。
+设置环境变量 PROMPT_WAR_METRICS=1 或调用 metrics.enable() 打开；
+PROMPT_WAR_METRICS_JSONL 记录每个事件，PROMPT_WAR_METRICS_PROM / PROMPT_WAR_METRICS_SUMMARY
+在进程退出时写出 Prometheus 文本和 JSONL 汇总。
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class StageStats:
+    __slots__ = ("count", "total", "max", "last")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_s": self.total,
+            "mean_s": self.total / self.count if self.count else 0.0,
+            "max_s": self.max,
+            "last_s": self.last,
+        }
+
+
+class Registry:
+    """
+    进程内的指标注册表
+
+    参数:
+        enabled: 是否记录
+        jsonl_path: 不为空时每次计时追加一行 JSON 事件
+        recent: 保留最近若干条事件，供界面显示本轮的阶段耗时
+    """
+
+    def __init__(self, enabled: bool = False, jsonl_path: Optional[str] = None, recent: int = 256):
+        self.enabled = enabled
+        self.jsonl_path = jsonl_path
+        self.stages: Dict[str, StageStats] = {}
+        self.counters: Dict[str, int] = {}
+        self.events = deque(maxlen=recent)
+        self._lock = threading.Lock()
+        self._jsonl = None
+        self._context = threading.local()
+
+    def timer(self, stage: str):
+        if not self.enabled:
+            return _NULL_TIMER
+        return self._timer(stage)
+
+    @contextmanager
+    def _timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def tag(self, job):
+        """在当前线程内给之后的事件标记 job（例如流水线的 job_id），并发的多个请求可分别汇总"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return self._tag(job)
+
+    @contextmanager
+    def _tag(self, job):
+        previous = getattr(self._context, "job", None)
+        self._context.job = job
+        try:
+            yield
+        finally:
+            self._context.job = previous
+
+    def observe(self, stage: str, seconds: float):
+        if not self.enabled:
+            return
+        event = {"ts": time.time(), "stage": stage, "seconds": seconds, "thread": threading.current_thread().name}
+        job = getattr(self._context, "job", None)
+        if job is not None:
+            event["job"] = job
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats()
+            stats.add(seconds)
+            self.events.append(event)
+            if self.jsonl_path:
+                if self._jsonl is None:
+                    self._jsonl = open(self.jsonl_path, "a", encoding="utf-8")
+                self._jsonl.write(json.dumps(event) + "\n")
+                self._jsonl.flush()
+
+    def incr(self, name: str, value: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def breakdown(self, prefix: str = "", since: float = 0.0, job=None) -> Dict[str, float]:
+        """
+        按阶段汇总最近事件的耗时（秒），用于界面状态栏
+
+        参数:
+            job: 只汇总用 tag(job) 标记的事件；None 表示按 since 汇总所有事件
+        """
+        with self._lock:
+            events = list(self.events)
+        out = {}
+        for event in events:
+            if job is not None and event.get("job") != job:
+                continue
+            if event["ts"] >= since and event["stage"].startswith(prefix):
+                out[event["stage"]] = out.get(event["stage"], 0.0) + event["seconds"]
+        return out
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "stages": {name: stats.to_dict() for name, stats in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+    def export_jsonl(self, path: str):
+        """把当前汇总追加写入 JSONL 文件"""
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(dict(self.snapshot(), ts=time.time())) + "\n")
+
+    def prometheus(self) -> str:
+        """Prometheus 文本格式"""
+        snap = self.snapshot()
+        lines = [
+            "# TYPE prompt_war_stage_seconds summary",
+        ]
+        for name, stats in sorted(snap["stages"].items()):
+            lines.append(f'prompt_war_stage_seconds_count{{stage="{name}"}} {stats["count"]}')
+            lines.append(f'prompt_war_stage_seconds_sum{{stage="{name}"}} {stats["total_s"]:.6f}')
+        lines.append("# TYPE prompt_war_stage_seconds_max gauge")
+        for name, stats in sorted(snap["stages"].items()):
+            lines.append(f'prompt_war_stage_seconds_max{{stage="{name}"}} {stats["max_s"]:.6f}')
+        lines.append("# TYPE prompt_war_events_total counter")
+        for name, value in sorted(snap["counters"].items()):
+            lines.append(f'prompt_war_events_total{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def export_prometheus(self, path: str):
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(tmp, path)
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+            self.counters.clear()
+            self.events.clear()
+
+
+registry = Registry(
+    enabled=os.getenv("PROMPT_WAR_METRICS", "") not in ("", "0"),
+    jsonl_path=os.getenv("PROMPT_WAR_METRICS_JSONL") or None,
+)
+
+
+def _export_on_exit():
+    if not registry.enabled:
+        return
+    prom_path = os.getenv("PROMPT_WAR_METRICS_PROM")
+    if prom_path:
+        registry.export_prometheus(prom_path)
+    summary_path = os.getenv("PROMPT_WAR_METRICS_SUMMARY")
+    if summary_path:
+        registry.export_jsonl(summary_path)
+
+
+# 退出时按环境变量导出 Prometheus 文本 / JSONL 汇总
+atexit.register(_export_on_exit)
+
+timer = registry.timer
+tag = registry.tag
+observe = registry.observe
+incr = registry.incr
+
+
+def enable(jsonl_path: Optional[str] = None):
+    registry.enabled = True
+    if jsonl_path:
+        registry.jsonl_path = jsonl_path
+
+
+def disable():
+    registry.enabled = False
+
+
+def format_breakdown(breakdown: Dict[str, float]) -> str:
+    """把阶段耗时格式化成 "stage 12ms | stage 340ms" """
+    return " | ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in breakdown.items())
@@ -0,0 +1,139 @@
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from src import metrics
+
+
+@dataclass
+class Job:
+    """一次 生成 -> 下载解码 -> 打分 的请求"""
+    job_id: int
+    prompt: str
+    target: Any
+    epoch: int
+    submitted_at: float = field(default_factory=time.perf_counter)
+    cancelled: bool = False
+
+
+@dataclass
+class PipelineResult:
+    job_id: int
+    prompt: str
+    image: Any = None
+    img_loss: Optional[float] = None
+    str_loss: Optional[float] = None
+    error: Optional[BaseException] = None
+    stage: str = "done"
+    elapsed: float = 0.0
+    # 提交时的 epoch，与 GeneratePipeline.epoch 不同说明目标已更换，结果应丢弃
+    epoch: int = 0
+
+
+class GeneratePipeline:
+    """
+    多阶段后台流水线：生成（请求接口）、下载解码、打分各用一个线程池，
+    结果放入 results 队列，由界面线程通过 root.after() 轮询取出。
+
+    参数:
+        generate_fn: prompt -> URL（或直接返回图片）
+        download_fn: URL -> PIL 图片
+        score_fn: (prompt, image, target) -> (img_loss, str_loss)
+        max_in_flight: 同时进行的生成请求数
+        score_workers: 打分线程数（CLIP 推理本身已多线程，默认 1）
+    """
+
+    def __init__(
+        self,
+        generate_fn: Callable[[str], Any],
+        download_fn: Callable[[Any], Any],
+        score_fn: Callable[[str, Any, Any], tuple],
+        max_in_flight: int = 4,
+        score_workers: int = 1,
+    ):
+        self.generate_fn = generate_fn
+        self.download_fn = download_fn
+        self.score_fn = score_fn
+        self.results = queue.Queue()
+        self._generate_pool = ThreadPoolExecutor(max_in_flight, thread_name_prefix="generate")
+        self._download_pool = ThreadPoolExecutor(max_in_flight, thread_name_prefix="download")
+        self._score_pool = ThreadPoolExecutor(score_workers, thread_name_prefix="score")
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self.epoch = 0
+
+    def submit(self, prompt: str, target: Any) -> Job:
+        """提交一个提示词，立即返回 Job"""
+        with self._lock:
+            job = Job(next(self._ids), prompt, target, self.epoch)
+            self._jobs[job.job_id] = job
+        self._generate_pool.submit(self._run_stage, job, "generate", self.generate_fn, (prompt,))
+        return job
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._jobs)
+
+    def cancel(self, job_id: int):
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job:
+            job.cancelled = True
+
+    def cancel_stale(self):
+        """目标图片变化后调用：之前提交的所有请求都作废"""
+        with self._lock:
+            self.epoch += 1
+            stale = list(self._jobs.values())
+            self._jobs.clear()
+        for job in stale:
+            job.cancelled = True
+
+    def is_stale(self, result: PipelineResult) -> bool:
+        """结果是否属于 cancel_stale() 之前提交的请求（可能在作废前已进入 results 队列）"""
+        return result.epoch != self.epoch
+
+    def shutdown(self):
+        self.cancel_stale()
+        for pool in (self._generate_pool, self._download_pool, self._score_pool):
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run_stage(self, job: Job, stage: str, fn: Callable, args: tuple):
+        # 已取消的请求直接丢弃，不再进入后续阶段
+        if job.cancelled:
+            return
+        try:
+            # 各阶段内部的计时事件都标记 job_id，界面按 job 汇总本轮耗时
+            with metrics.tag(job.job_id):
+                value = fn(*args)
+        except Exception as e:
+            self._finish(job, PipelineResult(job.job_id, job.prompt, error=e, stage=stage, epoch=job.epoch))
+            return
+        if job.cancelled:
+            return
+        if stage == "generate":
+            if isinstance(value, str):
+                self._download_pool.submit(self._run_stage, job, "download", self.download_fn, (value,))
+            else:
+                # 生成函数直接返回了图片（例如空提示词的占位图）
+                self._score_pool.submit(self._run_stage, job, "score", self._score, (job, value))
+        elif stage == "download":
+            self._score_pool.submit(self._run_stage, job, "score", self._score, (job, value))
+        else:
+            self._finish(job, value)
+
+    def _score(self, job: Job, image: Any) -> PipelineResult:
+        img_loss, str_loss = self.score_fn(job.prompt, image, job.target)
+        return PipelineResult(job.job_id, job.prompt, image, img_loss, str_loss, epoch=job.epoch)
+
+    def _finish(self, job: Job, result: PipelineResult):
+        with self._lock:
+            if self._jobs.pop(job.job_id, None) is None:
+                return
+        result.elapsed = time.perf_counter() - job.submitted_at
+        self.results.put(result)
@@ -0,0 +1,150 @@
+import numpy as np
+from PIL import Image
+from typing import Iterable, Optional, Sequence, Tuple, Union
+
+# 亮度权重 (ITU-R BT.601)，SSIM 在灰度上计算
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+_SSIM_C1 = (0.01 * 255) ** 2
+_SSIM_C2 = (0.03 * 255) ** 2
+
+ImageLike = Union[Image.Image, np.ndarray]
+
+
+def to_array(img: ImageLike, size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """
+    将图片转换为 float32 的 HxWx3 数组，可选先缩放到 size=(宽, 高)
+    """
+    if isinstance(img, np.ndarray):
+        arr = img.astype(np.float32, copy=False)
+        if size is not None and arr.shape[:2] != (size[1], size[0]):
+            img = Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8))
+        else:
+            return arr
+    img = img.convert("RGB")
+    if size is not None and img.size != tuple(size):
+        img = img.resize(tuple(size), Image.Resampling.BILINEAR)
+    return np.asarray(img, dtype=np.float32)
+
+
+def align_images(
+    target: ImageLike,
+    candidates: Union[ImageLike, Sequence[ImageLike]],
+    size: Optional[Tuple[int, int]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    将目标图与候选图对齐到同一分辨率
+
+    参数:
+        target: 目标图片
+        candidates: 单张候选图或候选图列表
+        size: 统一的 (宽, 高)，默认使用目标图尺寸
+
+    返回:
+        (目标数组 HxWx3, 候选数组 NxHxWx3)
+    """
+    if isinstance(candidates, (Image.Image, np.ndarray)):
+        candidates = [candidates]
+    target_arr = to_array(target, size)
+    h, w = target_arr.shape[:2]
+    batch = np.stack([to_array(c, (w, h)) for c in candidates])
+    return target_arr, batch
+
+
+def l1_loss(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """每个像素三通道绝对差之和的均值（与旧版 get_loss 数值一致）"""
+    return np.abs(a - b).sum(axis=-1).mean(axis=(-2, -1))
+
+
+def l2_loss(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """逐元素均方误差"""
+    diff = a - b
+    return (diff * diff).mean(axis=(-3, -2, -1))
+
+
+def _box_mean(x: np.ndarray, k: int) -> np.ndarray:
+    """利用积分图计算 k×k 窗口均值（valid 模式），x 形状为 (..., H, W)"""
+    c = np.cumsum(x, axis=-2, dtype=np.float64)
+    c = np.concatenate([np.zeros_like(c[..., :1, :]), c], axis=-2)
+    x = c[..., k:, :] - c[..., :-k, :]
+    c = np.cumsum(x, axis=-1)
+    c = np.concatenate([np.zeros_like(c[..., :1]), c], axis=-1)
+    return (c[..., k:] - c[..., :-k]) / (k * k)
+
+
+def ssim_loss(a: np.ndarray, b: np.ndarray, window: int = 7) -> np.ndarray:
+    """1 - SSIM，在灰度图上使用均匀窗口计算"""
+    x = a @ _LUMA
+    y = b @ _LUMA
+    k = max(1, min(window, x.shape[-2], x.shape[-1]))
+    mu_x = _box_mean(x, k)
+    mu_y = _box_mean(y, k)
+    sxx = _box_mean(x * x, k) - mu_x * mu_x
+    syy = _box_mean(y * y, k) - mu_y * mu_y
+    sxy = _box_mean(x * y, k) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + _SSIM_C1) * (2 * sxy + _SSIM_C2)) / (
+        (mu_x * mu_x + mu_y * mu_y + _SSIM_C1) * (sxx + syy + _SSIM_C2)
+    )
+    return 1.0 - ssim_map.mean(axis=(-2, -1))
+
+
+def _downsample(x: np.ndarray) -> np.ndarray:
+    """2x2 平均池化，奇数边会被裁掉"""
+    h, w = x.shape[-3] // 2 * 2, x.shape[-2] // 2 * 2
+    x = x[..., :h, :w, :]
+    return 0.25 * (x[..., 0::2, 0::2, :] + x[..., 1::2, 0::2, :] + x[..., 0::2, 1::2, :] + x[..., 1::2, 1::2, :])
+
+
+def multiscale_loss(a: np.ndarray, b: np.ndarray, base: str = "ssim", levels: int = 3) -> np.ndarray:
+    """在图像金字塔的每一层计算 base 损失并取平均"""
+    fn = LOSSES[base]
+    total = fn(a, b)
+    used = 1
+    for _ in range(levels - 1):
+        if min(a.shape[-3], a.shape[-2]) < 2:
+            break
+        a, b = _downsample(a), _downsample(b)
+        total = total + fn(a, b)
+        used += 1
+    return total / used
+
+
+LOSSES = {
+    "l1": l1_loss,
+    "l2": l2_loss,
+    "ssim": ssim_loss,
+}
+
+
+def batch_loss(
+    target: ImageLike,
+    candidates: Iterable[ImageLike],
+    metric: str = "l1",
+    size: Optional[Tuple[int, int]] = None,
+    levels: int = 1,
+) -> np.ndarray:
+    """
+    一次调用计算多张候选图相对同一目标图的损失
+
+    参数:
+        target: 目标图片
+        candidates: 候选图片列表
+        metric: "l1" / "l2" / "ssim"
+        size: 统一缩放到的 (宽, 高)，默认使用目标图尺寸；传入较小尺寸可显著提速
+        levels: 大于 1 时使用多尺度损失
+
+    返回:
+        长度为 N 的损失数组
+    """
+    if metric not in LOSSES:
+        raise ValueError(f"未知的损失类型: {metric}")
+    target_arr, batch = align_images(target, list(candidates), size)
+    if levels > 1:
+        return multiscale_loss(target_arr, batch, base=metric, levels=levels)
+    return LOSSES[metric](target_arr, batch)
+
+
+def get_loss(image1: ImageLike, image2: ImageLike, metric: str = "l1", size: Optional[Tuple[int, int]] = None) -> float:
+    """
+    计算两张图片之间的损失，分辨率不同时先将 image2 缩放到 image1 的尺寸
+    """
+    return float(batch_loss(image1, [image2], metric=metric, size=size)[0])
@@ -0,0 +1,186 @@
+"""
+自动提示词搜索：先用本地 CLIP 文本-图像相似度给候选提示词排序（几乎零成本），
+只把排名靠前的少数候选交给付费的文生图接口。
+
+    python -m src.prompt_search --target i1.jpg --prompt "一只猫" --budget 6
+"""
+import argparse
+import json
+import time
+from dataclasses import asdict, dataclass, field
+from functools import partial
+from typing import Callable, List, Optional
+
+from src.image_io import load_image
+from src.loss import score_batch
+
+# 组合权重与 ImagePromptGame 相同（图像项 0.2 + 语义项），但这里的两项都是余弦相似度，越高越接近目标
+IMAGE_WEIGHT = 0.2
+
+REWRITE_PROMPT = (
+    "你是文生图提示词专家。根据用户给出的提示词，写出 {n} 个描述同一画面但措辞、细节、风格各不相同的改写版本，"
+    "每行一个，不要编号，不要输出其他内容。"
+)
+
+
+@dataclass
+class Candidate:
+    prompt: str
+    text_score: float
+    image_score: Optional[float] = None
+
+    @property
+    def score(self) -> Optional[float]:
+        """组合得分（越高越接近目标），未生成图片时为 None"""
+        if self.image_score is None:
+            return None
+        return self.image_score * IMAGE_WEIGHT + self.text_score
+
+
+@dataclass
+class SearchReport:
+    seed_prompt: str
+    rounds: int = 0
+    proposed: int = 0
+    generations: int = 0
+    best: Optional[Candidate] = None
+    initial_score: Optional[float] = None
+    generated: List[Candidate] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def improvement(self) -> float:
+        """最佳候选相对基线的得分提升"""
+        if self.best is None or self.initial_score is None:
+            return 0.0
+        return self.best.score - self.initial_score
+
+    @property
+    def improvement_per_generation(self) -> float:
+        return self.improvement / self.generations if self.generations else 0.0
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["improvement"] = self.improvement
+        data["improvement_per_generation"] = self.improvement_per_generation
+        return data
+
+
+def parse_variants(text: str) -> List[str]:
+    variants = []
+    for line in (text or "").splitlines():
+        line = line.strip().lstrip("-*•").strip()
+        # 去掉模型偶尔仍会加上的编号，如 "1." / "2、"
+        head, sep, rest = line.partition(".")
+        if not sep:
+            head, sep, rest = line.partition("、")
+        if sep and head.strip().isdigit():
+            line = rest.strip()
+        if line:
+            variants.append(line)
+    return variants
+
+
+def propose_variants(prompt: str, n: int, complete: Optional[Callable] = None) -> List[str]:
+    """用聊天模型改写出 n 个候选提示词"""
+    if complete is None:
+        from src.call_llm import get_chat_completion
+        # 改写输出比攻防判定长得多，固定 max_tokens，不参与自适应统计
+        complete = partial(get_chat_completion, max_tokens=2000)
+    result = complete(REWRITE_PROMPT.format(n=n), prompt)
+    if result is None:
+        return []
+    content = result[0] if isinstance(result, tuple) else result
+    return parse_variants(content)[:n]
+
+
+def search_prompts(
+    seed_prompt: str,
+    target,
+    rounds: int = 3,
+    variants_per_round: int = 8,
+    top_k: int = 2,
+    budget: int = 6,
+    complete: Optional[Callable] = None,
+    generate: Optional[Callable] = None,
+) -> SearchReport:
+    """
+    迭代搜索提示词
+
+    参数:
+        seed_prompt: 初始提示词（会先生成一次作为基线）
+        target: 目标图片
+        rounds: 改写轮数
+        variants_per_round: 每轮改写出的候选数
+        top_k: 每轮最多生成图片的候选数（按文本相似度从高到低排序）
+        budget: 整个搜索最多调用文生图接口的次数（含基线）
+        complete: 聊天补全函数，默认 get_chat_completion
+        generate: 文生图函数，默认 get_image_generate
+
+    返回:
+        SearchReport，包含生成次数、最佳候选和每次生成的收益
+    """
+    if generate is None:
+        from src.call_llm import get_image_generate
+        generate = get_image_generate
+    start = time.perf_counter()
+    report = SearchReport(seed_prompt)
+    seen = {seed_prompt}
+
+    def generate_and_score(candidate: Candidate):
+        image = generate(candidate.prompt)
+        candidate.image_score = float(score_batch(images=[image], targets=[target])[0, 0])
+        report.generations += 1
+        report.generated.append(candidate)
+        if report.best is None or candidate.score > report.best.score:
+            report.best = candidate
+
+    seed = Candidate(seed_prompt, float(score_batch(texts=[seed_prompt], targets=[target])[0, 0]))
+    if budget > 0:
+        generate_and_score(seed)
+        report.initial_score = seed.score
+
+    for _ in range(rounds):
+        if report.generations >= budget:
+            break
+        base = report.best.prompt if report.best else seed_prompt
+        variants = [v for v in propose_variants(base, variants_per_round, complete) if v not in seen]
+        seen.update(variants)
+        report.rounds += 1
+        report.proposed += len(variants)
+        if not variants:
+            continue
+        # 一次前向 + 一次矩阵乘法给本轮所有候选打分
+        text_scores = score_batch(texts=variants, targets=[target])[:, 0]
+        ranked = sorted(
+            (Candidate(v, float(s)) for v, s in zip(variants, text_scores)),
+            key=lambda c: c.text_score,
+            reverse=True,
+        )
+        for candidate in ranked[:top_k]:
+            if report.generations >= budget:
+                break
+            generate_and_score(candidate)
+
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="基于 CLIP 预排序的提示词搜索")
+    parser.add_argument("--target", required=True, help="目标图片路径")
+    parser.add_argument("--prompt", required=True, help="初始提示词")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--variants", type=int, default=8, help="每轮改写数量")
+    parser.add_argument("--top-k", type=int, default=2, help="每轮送去生成的候选数")
+    parser.add_argument("--budget", type=int, default=6, help="文生图调用次数上限")
+    args = parser.parse_args(argv)
+
+    report = search_prompts(
+        args.prompt, load_image(args.target), args.rounds, args.variants, args.top_k, args.budget,
+    )
+    print(json.dumps(report.to_dict(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+token 预算与请求规划：
+
+    from src.token_budget import TokenBudget, planner
+    plan = planner.plan(system, user, budget)        # 发送前本地估算 prompt 大小并选定 max_tokens
+    ...
+    planner.settle(plan, prompt_tokens, completion_tokens, truncated)
+
+max_tokens 根据最近的实际输出长度自适应选取（取 p95 再留余量，并取整到 2 的幂），
+输出被截断时自动放大。全局预算由环境变量 LLM_TOKEN_BUDGET 指定，
+单局预算见 DefenseGame.token_budget。
+"""
+import os
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+# GLM 系列分词器中一个汉字大约对应一个 token，其余文本约 4 个字符一个 token
+_CJK = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+MESSAGE_OVERHEAD = 4   # 每条消息的角色、分隔符
+REQUEST_OVERHEAD = 3
+
+
+class BudgetExceededError(Exception):
+    """预算不足以发出请求"""
+
+
+def estimate_tokens(text: str) -> int:
+    """本地粗略估算文本的 token 数"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_prompt_tokens(messages: Sequence[dict]) -> int:
+    return REQUEST_OVERHEAD + sum(MESSAGE_OVERHEAD + estimate_tokens(m.get("content") or "") for m in messages)
+
+
+class TokenBudget:
+    """
+    线程安全的 token 预算：发送前按 估算 prompt + max_tokens 预留，返回后按实际用量结算
+
+    参数:
+        limit: 预算上限，None 表示不限
+        name: 报告中显示的名称
+    """
+
+    def __init__(self, limit: Optional[int] = None, name: str = "budget"):
+        self.limit = limit
+        self.name = name
+        self.spent = 0
+        self.reserved = 0
+        self._lock = threading.Lock()
+
+    def remaining(self) -> Optional[int]:
+        if self.limit is None:
+            return None
+        with self._lock:
+            return max(0, self.limit - self.spent - self.reserved)
+
+    def exhausted(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def reserve(self, tokens: int):
+        with self._lock:
+            if self.limit is not None and self.spent + self.reserved + tokens > self.limit:
+                raise BudgetExceededError(
+                    f"{self.name} 预算不足：需要约 {tokens}，剩余 {max(0, self.limit - self.spent - self.reserved)}"
+                )
+            self.reserved += tokens
+
+    def settle(self, reserved: int, used: int):
+        with self._lock:
+            self.reserved -= reserved
+            self.spent += used
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "limit": self.limit, "spent": self.spent, "reserved": self.reserved}
+
+
+@dataclass
+class Plan:
+    max_tokens: int
+    estimated_prompt_tokens: int
+    reserved: int = 0
+    budgets: tuple = ()
+    adaptive: bool = True  # max_tokens 由规划器选取（调用方显式指定时不计入长度统计）
+
+
+def _quantize(n: int, floor: int, ceiling: int) -> int:
+    size = floor
+    while size < n:
+        size *= 2
+    return min(size, ceiling)
+
+
+class TokenPlanner:
+    """
+    根据最近的输出长度选择 max_tokens，并同时检查全局预算和调用方传入的预算
+
+    参数:
+        global_budget: 进程内所有请求共享的预算
+        floor / ceiling: max_tokens 的取值范围（ceiling 与原来固定的 2000 相同）
+        initial: 样本不足时使用的 max_tokens
+        headroom: 在最近输出长度的 p95 上留出的余量倍数
+        window: 统计最近多少次输出
+    """
+
+    def __init__(
+        self,
+        global_budget: Optional[TokenBudget] = None,
+        floor: int = 64,
+        ceiling: int = 2000,
+        initial: int = 512,
+        headroom: float = 1.5,
+        window: int = 200,
+        min_samples: int = 5,
+    ):
+        self.global_budget = global_budget or TokenBudget(None, "global")
+        self.floor = floor
+        self.ceiling = ceiling
+        self.initial = initial
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self._lengths = deque(maxlen=window)
+        self._bump = 1  # 出现截断后临时放大的倍数
+        self._lock = threading.Lock()
+        # 估算值与实际值的对照
+        self.calls = 0
+        self.estimated_prompt = 0
+        self.actual_prompt = 0
+        self.matched_calls = 0  # 返回了 prompt_tokens 的请求
+        self.matched_estimated = 0
+        self.completion = 0
+        self.max_tokens_total = 0
+        self.truncated = 0
+        self.rejected = 0
+
+    def suggest_max_tokens(self) -> int:
+        with self._lock:
+            if len(self._lengths) < self.min_samples:
+                n = self.initial
+            else:
+                ordered = sorted(self._lengths)
+                n = int(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * self.headroom)
+            return _quantize(n * self._bump, self.floor, self.ceiling)
+
+    def plan(
+        self,
+        system: str,
+        user: str,
+        budget: Optional[TokenBudget] = None,
+        max_tokens: Optional[int] = None,
+    ) -> Plan:
+        """
+        发送前调用：估算 prompt，选定 max_tokens（不超过剩余预算），并在各预算中预留
+
+        预算连 prompt + floor 都不够时抛出 BudgetExceededError
+        """
+        estimate = estimate_prompt_tokens([{"content": system}, {"content": user}])
+        adaptive = max_tokens is None
+        max_tokens = max_tokens or self.suggest_max_tokens()
+        budgets = tuple(b for b in (self.global_budget, budget) if b is not None and b.limit is not None)
+        for b in budgets:
+            remaining = b.remaining()
+            if remaining < estimate + self.floor:
+                with self._lock:
+                    self.rejected += 1
+                raise BudgetExceededError(f"{b.name} 预算不足：剩余 {remaining}，本次请求约需 {estimate + self.floor}")
+            max_tokens = min(max_tokens, remaining - estimate)
+        reserved = estimate + max_tokens
+        done = []
+        try:
+            for b in budgets:
+                b.reserve(reserved)
+                done.append(b)
+        except BudgetExceededError:
+            # 并发请求抢先用掉了预算
+            for b in done:
+                b.settle(reserved, 0)
+            with self._lock:
+                self.rejected += 1
+            raise
+        return Plan(max_tokens, estimate, reserved, budgets, adaptive)
+
+    def cancel(self, plan: Plan):
+        """请求失败时释放预留，不记账"""
+        for b in plan.budgets:
+            b.settle(plan.reserved, 0)
+
+    def settle(
+        self,
+        plan: Plan,
+        prompt_tokens: Optional[int],
+        completion_tokens: Optional[int],
+        truncated: bool = False,
+        cached: bool = False,
+        complete: bool = True,
+    ):
+        """
+        请求结束后调用，释放预留并按实际用量记账
+
+        参数:
+            prompt_tokens / completion_tokens: 服务端返回的用量，缺失时以估算值记账
+            truncated: 输出因 max_tokens 被截断
+            cached: 结果来自本地缓存（不消耗 token）
+            complete: 输出是否完整（流式提前终止时为 False，不计入长度统计）
+        """
+        if cached:
+            used = 0
+        else:
+            used = (prompt_tokens if prompt_tokens is not None else plan.estimated_prompt_tokens) + (completion_tokens or 0)
+        for b in plan.budgets:
+            b.settle(plan.reserved, used)
+        with self._lock:
+            if cached:
+                return
+            self.calls += 1
+            self.estimated_prompt += plan.estimated_prompt_tokens
+            self.max_tokens_total += plan.max_tokens
+            self.completion += completion_tokens or 0
+            if prompt_tokens is not None:
+                self.matched_calls += 1
+                self.matched_estimated += plan.estimated_prompt_tokens
+                self.actual_prompt += prompt_tokens
+            if truncated:
+                self.truncated += 1
+            if not plan.adaptive:
+                return
+            if truncated:
+                self._bump = min(self._bump * 2, 32)
+            elif complete and completion_tokens is not None:
+                self._lengths.append(completion_tokens)
+                self._bump = 1
+
+    def report(self) -> dict:
+        """估算与实际用量对照"""
+        next_max_tokens = self.suggest_max_tokens()
+        with self._lock:
+            error = None
+            if self.matched_calls and self.actual_prompt:
+                error = (self.matched_estimated - self.actual_prompt) / self.actual_prompt
+            return {
+                "calls": self.calls,
+                "rejected": self.rejected,
+                "estimated_prompt_tokens": self.estimated_prompt,
+                "actual_prompt_tokens": self.actual_prompt,
+                "prompt_estimate_error": error,  # 相对误差，正数表示高估
+                "completion_tokens": self.completion,
+                "mean_max_tokens": self.max_tokens_total / self.calls if self.calls else None,
+                "next_max_tokens": next_max_tokens,
+                "truncated": self.truncated,
+                "global_budget": self.global_budget.to_dict(),
+            }
+
+
+def _budget_from_env() -> TokenBudget:
+    value = os.getenv("LLM_TOKEN_BUDGET", "")
+    return TokenBudget(int(value) if value else None, "global")
+
+
+planner = TokenPlanner(_budget_from_env())
+
+
+def format_report(report: dict) -> str:
+    error = report["prompt_estimate_error"]
+    return (
+        f"请求 {report['calls']} 次（预算拒绝 {report['rejected']} 次），"
+        f"prompt 估算 {report['estimated_prompt_tokens']} / 实际 {report['actual_prompt_tokens']}"
+        f"{'' if error is None else f'（误差 {error:+.1%}）'}，"
+        f"输出 {report['completion_tokens']} token，平均 max_tokens "
+        f"{report['mean_max_tokens'] or 0:.0f}，截断 {report['truncated']} 次"
+    )
@@ -0,0 +1,83 @@
+import json
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+from src.attempt_store import AttemptStore
+
+DIM = 4
+
+
+def add(store, i):
+    # 每次尝试使用不同的单位向量，近邻查询能唯一地找回它
+    embedding = np.eye(DIM, dtype=np.float32)[i % DIM] + 0.01 * i
+    image = Image.new("RGB", (8, 8), (i * 20, 0, 0))
+    target = Image.new("RGB", (8, 8))
+    return store.add(f"prompt {i}", image, target, 0.5, 0.1 * i, 0.1 * i, embedding, embedding)
+
+
+def jsonl_ids(root):
+    with open(os.path.join(root, "attempts.jsonl"), encoding="utf-8") as f:
+        return [json.loads(line)["attempt_id"] for line in f if line.strip()]
+
+
+def assert_aligned(store):
+    for i, record in enumerate(store.records):
+        assert record.attempt_id == i
+        embedding = np.eye(DIM, dtype=np.float32)[i % DIM] + 0.01 * i
+        assert store.nearest_prompts(embedding, 1)[0][1].prompt == record.prompt
+
+
+def test_short_embeddings_file_truncates_attempts(tmp_path):
+    root = str(tmp_path)
+    store = AttemptStore(root)
+    for i in range(3):
+        add(store, i)
+    # 只剩两行嵌入（例如写入中途崩溃或文件被截断）
+    with open(store.embeddings_path, "r+b") as f:
+        f.truncate(2 * 2 * DIM * 4)
+
+    store = AttemptStore(root)
+    assert len(store) == 2
+    assert jsonl_ids(root) == [0, 1]
+    assert add(store, 3).attempt_id == 2
+
+    store = AttemptStore(root)
+    assert jsonl_ids(root) == [0, 1, 2]
+    assert [r.prompt for r in store.records] == ["prompt 0", "prompt 1", "prompt 3"]
+    assert_aligned(store)
+
+
+def test_missing_meta_discards_unusable_embeddings(tmp_path):
+    root = str(tmp_path)
+    store = AttemptStore(root)
+    for i in range(2):
+        add(store, i)
+    os.remove(store.meta_path)
+
+    store = AttemptStore(root)
+    assert len(store) == 0
+    assert jsonl_ids(root) == []
+    assert os.path.getsize(store.embeddings_path) == 0
+    add(store, 5)
+
+    store = AttemptStore(root)
+    assert [r.prompt for r in store.records] == ["prompt 5"]
+    assert_aligned(store)
+
+
+def test_partial_last_line_is_dropped(tmp_path):
+    root = str(tmp_path)
+    store = AttemptStore(root)
+    for i in range(2):
+        add(store, i)
+    with open(os.path.join(root, "attempts.jsonl"), "a", encoding="utf-8") as f:
+        f.write('{"attempt_id": 2, "ts": 1')
+
+    store = AttemptStore(root)
+    assert len(store) == 2
+    assert add(store, 2).attempt_id == 2
+    assert jsonl_ids(root) == [0, 1, 2]
@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("PIL")
+pytest.importorskip("httpx")
+pytest.importorskip("requests")
+
+from src import call_llm
+from src.defense_game import evaluate_attack
+
+
+class BrokenStream:
+    """产出一块文本后读取失败（例如读取超时或连接被重置）"""
+
+    def __init__(self):
+        self.closed = False
+
+    def __iter__(self):
+        delta = SimpleNamespace(content="partial ")
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=None)], usage=None)
+        raise ConnectionResetError("connection reset by peer")
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def broken_stream(monkeypatch):
+    stream = BrokenStream()
+    monkeypatch.setattr(call_llm, "_create_chat", lambda messages, max_tokens, **kwargs: stream)
+    return stream
+
+
+def test_mid_stream_error_returns_none(broken_stream):
+    chunks = call_llm.get_chat_completion("system", "user", max_tokens=16, use_cache=False, use_stream=True)
+    assert next(chunks) == "partial "
+    with pytest.raises(StopIteration) as stop:
+        next(chunks)
+    assert stop.value.value is None
+    assert broken_stream.closed
+
+
+def test_mid_stream_error_is_reported_by_evaluate_attack(broken_stream):
+    received = []
+    result = evaluate_attack(
+        "secret", "defense", "attack", complete=lambda *a, **kw: call_llm.get_chat_completion(*a, use_cache=False, **kw),
+        stream=True, on_chunk=received.append,
+    )
+    assert received == ["partial "]
+    assert result.error is not None
+    assert result.content == "partial "
+    assert not result.success
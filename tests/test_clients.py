@@ -0,0 +1,49 @@
+import sys
+import threading
+import types
+
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("requests")
+
+from src.clients import ClientPool, is_retryable
+
+
+class FakeClient:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+
+def _call_with_timeout(fn, timeout=5.0):
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("value", fn()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "client creation deadlocked"
+    return result["value"]
+
+
+@pytest.mark.parametrize("module, cls, method", [
+    ("openai", "OpenAI", "openai"),
+    ("zhipuai", "ZhipuAI", "zhipu"),
+])
+def test_sdk_client_creation_does_not_deadlock(monkeypatch, module, cls, method):
+    monkeypatch.setitem(sys.modules, module, types.SimpleNamespace(**{cls: FakeClient}))
+    pool = ClientPool()
+    client = _call_with_timeout(getattr(pool, method))
+    assert client is getattr(pool, method)()
+    assert client.kwargs["http_client"] is pool.http()
+    assert pool.stats()["clients_created"] == 2
+    pool.close()
+
+
+def test_bad_request_is_not_retried():
+    class APIRequestFailedError(Exception):
+        status_code = 400
+
+    class APIConnectionError(Exception):
+        pass
+
+    assert not is_retryable(APIRequestFailedError())
+    assert is_retryable(APIConnectionError())
@@ -0,0 +1,33 @@
+from src.defense_game import KeywordMatcher
+
+
+def feed_all(keyword, chunks):
+    matcher = KeywordMatcher(keyword)
+    return [matcher.feed(chunk) for chunk in chunks]
+
+
+def test_keyword_within_one_chunk():
+    assert feed_all("苹果", ["我喜欢吃苹果。"]) == [True]
+
+
+def test_keyword_split_across_two_chunks():
+    assert feed_all("苹果", ["我喜欢吃苹", "果。"]) == [False, True]
+
+
+def test_keyword_split_across_many_chunks():
+    assert feed_all("secret", ["the s", "e", "cr", "et is"]) == [False, False, False, True]
+
+
+def test_keyword_spread_over_unrelated_chunks_is_not_matched():
+    assert feed_all("苹果", ["苹", "香蕉", "果"]) == [False, False, False]
+
+
+def test_single_character_keyword():
+    assert feed_all("果", ["苹", "果"]) == [False, True]
+
+
+def test_match_is_sticky():
+    matcher = KeywordMatcher("key")
+    assert matcher.feed("ke") is False
+    assert matcher.feed("y") is True
+    assert matcher.feed("nothing") is True
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+Image = pytest.importorskip("PIL.Image")
+
+from src import image_io, loss
+from src.embedding_cache import EmbeddingCache
+from src.gallery import TargetGallery
+
+
+class PooledPixelsBackend:
+    """不下载模型的替身：把预处理后的像素池化成特征，对模糊 / 重采样同样敏感"""
+    text_padding = "longest"
+
+    def image_features(self, pixel_values):
+        pooled = torch.nn.functional.adaptive_avg_pool2d(pixel_values, 16)
+        return pooled.flatten(1).numpy()
+
+
+@pytest.fixture
+def fake_clip(monkeypatch):
+    # 真实的 CLIP 预处理（短边缩放到 224 后中心裁剪），只替换模型本身
+    processor = transformers.CLIPImageProcessor()
+    monkeypatch.setattr(loss, "_processor", processor)
+    monkeypatch.setattr(loss, "_model", SimpleNamespace(config=SimpleNamespace(projection_dim=3 * 16 * 16)))
+    monkeypatch.setattr(loss, "_backend", PooledPixelsBackend())
+    monkeypatch.setattr(loss, "embedding_cache", EmbeddingCache())
+
+
+def _stripes(width, height, period):
+    x = np.arange(width)[None, :, None]
+    y = np.arange(height)[:, None, None]
+    pixels = (127 + 120 * np.sin(x / period) * np.cos(y / (period * 1.7)) + np.zeros((1, 1, 3))).astype(np.uint8)
+    pixels[..., 1] = (x[..., 0] * 255 // width).astype(np.uint8)
+    return Image.fromarray(pixels)
+
+
+def test_gallery_similarity_matches_calculate_loss_with_image(tmp_path, fake_clip):
+    # 非正方形目标：只限制长边时短边会降到 224 以下
+    _stripes(1024, 576, 1.3).save(tmp_path / "wide.png")
+    _stripes(600, 1200, 2.1).save(tmp_path / "tall.png")
+    probe = _stripes(512, 512, 1.7)
+
+    gallery = TargetGallery(str(tmp_path), use_cache=False)
+    matches = gallery.rank_image(probe, top=None)
+
+    assert {m.name for m in matches} == {"wide.png", "tall.png"}
+    for match in matches:
+        target = image_io.load_image(str(tmp_path / match.name))
+        assert match.similarity == pytest.approx(loss.calculate_loss_with_image(target, probe), abs=1e-5)
@@ -0,0 +1,26 @@
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from src import loss
+
+from test_gallery import _stripes
+
+
+@pytest.mark.parametrize("size", [(1500, 400), (2400, 600), (400, 1500), (800, 800)])
+def test_clip_pixel_values_match_unmodified_processor(monkeypatch, size):
+    processor = transformers.CLIPImageProcessor()
+    monkeypatch.setattr(loss, "_processor", processor)
+    monkeypatch.setattr(loss, "_model", SimpleNamespace())
+    img = _stripes(*size, 3.0)
+
+    fast = loss.clip_pixel_values(img).numpy()
+    reference = processor(images=img.convert("RGB"), return_tensors="pt")["pixel_values"].numpy()
+
+    # 预缩小只引入重采样误差；宽高比大于 2:1 时短边不能先降到 224 以下再被放大
+    assert fast.shape == reference.shape
+    assert np.abs(fast - reference).mean() < 0.01
@@ -0,0 +1,49 @@
+from src import metrics
+from src.pipeline import GeneratePipeline
+
+
+def make_pipeline():
+    return GeneratePipeline(
+        generate_fn=lambda prompt: object(),
+        download_fn=lambda url: url,
+        score_fn=lambda prompt, image, target: (0.1, 0.2),
+    )
+
+
+def test_result_queued_before_cancel_stale_is_stale():
+    pipeline = make_pipeline()
+    try:
+        pipeline.submit("a cat", "old target")
+        result = pipeline.results.get(timeout=5)
+        assert not pipeline.is_stale(result)
+
+        # 结果已在队列中时更换目标：界面取出后应丢弃
+        pipeline.cancel_stale()
+        assert pipeline.is_stale(result)
+
+        pipeline.submit("a dog", "new target")
+        assert not pipeline.is_stale(pipeline.results.get(timeout=5))
+    finally:
+        pipeline.shutdown()
+
+
+def test_stage_events_are_tagged_with_their_job(monkeypatch):
+    monkeypatch.setattr(metrics.registry, "enabled", True)
+    metrics.registry.reset()
+
+    def score(prompt, image, target):
+        metrics.observe("score." + prompt, 0.5 if prompt == "slow" else 0.1)
+        return 0.1, 0.2
+
+    pipeline = GeneratePipeline(lambda prompt: object(), lambda url: url, score, max_in_flight=2)
+    try:
+        jobs = {pipeline.submit(prompt, "target").job_id: prompt for prompt in ("slow", "fast")}
+        results = [pipeline.results.get(timeout=5) for _ in jobs]
+        # 其他线程（例如界面线程上的图库查询）未标记 job 的事件不计入
+        metrics.observe("gallery.query", 9.0)
+        for result in results:
+            prompt = jobs[result.job_id]
+            assert metrics.registry.breakdown(job=result.job_id) == {"score." + prompt: 0.5 if prompt == "slow" else 0.1}
+    finally:
+        pipeline.shutdown()
+        metrics.registry.reset()
@@ -0,0 +1,45 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+from src.pixel_loss import get_loss
+
+# 对照实现就是旧版的 getdata() 循环
+pytestmark = pytest.mark.filterwarnings("ignore:Image.Image.getdata:DeprecationWarning")
+
+
+def reference_loss(image1, image2):
+    """旧版 get_loss：逐像素循环"""
+    pixels1 = list(image1.convert("RGB").getdata())
+    pixels2 = list(image2.convert("RGB").getdata())
+    total = sum(abs(p1[0] - p2[0]) + abs(p1[1] - p2[1]) + abs(p1[2] - p2[2]) for p1, p2 in zip(pixels1, pixels2))
+    return total / len(pixels1)
+
+
+def random_image(size, seed, mode="RGB"):
+    rng = np.random.default_rng(seed)
+    image = Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+    return image.convert(mode)
+
+
+@pytest.mark.parametrize("size", [(1, 1), (64, 48), (257, 129)])
+def test_matches_getdata_loop_on_same_size_images(size):
+    a, b = random_image(size, 1), random_image(size, 2)
+    assert get_loss(a, b) == pytest.approx(reference_loss(a, b), rel=1e-6)
+
+
+def test_matches_getdata_loop_across_modes():
+    a, b = random_image((40, 30), 3, "L"), random_image((40, 30), 4, "RGBA")
+    assert get_loss(a, b) == pytest.approx(reference_loss(a, b), rel=1e-6)
+
+
+def test_mismatched_sizes_are_resized_not_truncated():
+    target = Image.new("RGB", (4, 4))
+    # 上半部分与目标相同、下半部分全白：按 zip 截断只会比较上半部分，得到 0
+    candidate = Image.new("RGB", (4, 8))
+    candidate.paste((255, 255, 255), (0, 4, 4, 8))
+    assert reference_loss(target, candidate) == 0
+    loss = get_loss(target, candidate)
+    assert loss > 0
+    assert loss == pytest.approx(get_loss(target, candidate.resize((4, 4), Image.Resampling.BILINEAR)))